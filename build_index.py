@@ -1,84 +1,108 @@
 import os
 import sys
+import numpy as np
 from dotenv import load_dotenv
-from typing import List
 from tqdm import tqdm  # 导入 tqdm 库
 
-# 核心依赖：LangChain的向量存储和Embedding基类
-from langchain_community.vectorstores import Chroma
-from langchain_core.embeddings import Embeddings as BaseEmbeddings
-
-# 严格按照用户要求，使用原生的 openai 客户端和 tiktoken
-from openai import OpenAI
-import tiktoken
+# 核心依赖：直接使用 chromadb 客户端批量写入，跳过 LangChain 的逐批包装
+import chromadb
 
 # 导入自定义模块。
-from rag_core.config import CHROMA_DB_PATH, COLLECTION_NAME, EMBEDDING_MODEL_NAME
-from rag_core.indexing_utils import get_processed_chunks
+from rag_core.config import CHROMA_DB_PATH, COLLECTION_NAME, EMBEDDING_MODEL_NAME, EMBEDDING_CHECKPOINT_PATH
+from rag_core.indexing_utils import get_processed_chunks, count_tokens
+# Embedding 包装器与 rag_core 共用同一实现 (内部并发请求各批次)
+from rag_core.dashscope_embedding import CustomDashScopeEmbeddings, DASHSCOPE_BASE_URL
 
-# 定义阿里云 DashScope 兼容模式的 Base URL
-DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+# 每次 collection.add 写入的知识块数量 (ChromaDB 推荐 50-250)，用于摊薄事务和 HNSW 更新开销
+CHROMA_ADD_BATCH_SIZE = 250
 
-# 关键修复：定义分批处理大小，根据 DashScope 错误信息，最大值不能超过 10
-BATCH_SIZE = 10
+# 首次构建 (集合为空) 的批量导入期间放宽 SQLite 的持久性保证 (构建失败时直接重跑即可)。
+# 增量更新时集合中已有付费生成的向量，关闭日志后中途崩溃或 Ctrl+C 可能损坏整个索引，因此使用默认设置
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "locking_mode": "EXCLUSIVE",
+}
 
 
-class CustomDashScopeEmbeddings(BaseEmbeddings):
+def _apply_bulk_load_pragmas(client) -> dict:
     """
-    自定义的 Embedding 包装器，用于使用原生的 openai.OpenAI 客户端
-    调用阿里云 DashScope 的兼容 API，同时满足 LangChain Embeddings 接口要求。
+    在 Chroma 底层 SQLite 连接上设置 BULK_LOAD_PRAGMAS，返回设置前的原值。
+    依赖 Chroma 内部 API，任何失败都会回退到默认设置，不影响导入。
     """
+    previous = {}
+    try:
+        server = getattr(client, "_server", client)
+        conn = server._sysdb._conn_pool.connect()
+        for name, value in BULK_LOAD_PRAGMAS.items():
+            previous[name] = conn.execute(f"PRAGMA {name}").fetchone()[0]
+            conn.execute(f"PRAGMA {name} = {value}")
+        print("-> 已为批量导入关闭 SQLite 日志与同步写盘。")
+    except Exception as e:
+        print(f"⚠️ 警告：无法设置 SQLite 批量导入参数，使用默认设置继续。错误信息: {e}")
+    return previous
 
-    def __init__(self, model: str, api_key: str, base_url: str):
-        self.model = model
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """
-        实现 LangChain 要求的文档 Embedding 方法，并强制进行分批处理。
-        """
-        all_embeddings: List[List[float]] = []
-
-        # 计算总批次数量
-        num_batches = (len(texts) + BATCH_SIZE - 1) // BATCH_SIZE
-
-        # --- 关键修复：手动分批处理 (Batching)，并使用 tqdm 显示进度 ---
-        for i in tqdm(range(0, len(texts), BATCH_SIZE),
-                      total=num_batches,
-                      desc="向量化批次进度"):
-            batch = texts[i:i + BATCH_SIZE]
-
-            # 调用原生的 client.embeddings.create API
-            try:
-                response = self.client.embeddings.create(
-                    model=self.model,
-                    input=batch
-                )
-                # 从响应中提取 embedding 向量并添加到总列表
-                batch_embeddings = [data.embedding for data in response.data]
-                all_embeddings.extend(batch_embeddings)
-            except Exception as e:
-                # 如果某一批次失败，打印错误，并重新抛出以终止流程
-                tqdm.write(f"❌ 警告：Embedding 过程中，批次 {i // BATCH_SIZE} 失败。错误信息: {e}")
-                raise e
 
-        return all_embeddings
+def _restore_pragmas(client, previous: dict):
+    """恢复 _apply_bulk_load_pragmas 修改前的 SQLite 设置。"""
+    if not previous:
+        return
+    try:
+        server = getattr(client, "_server", client)
+        conn = server._sysdb._conn_pool.connect()
+        for name, value in reversed(list(previous.items())):
+            conn.execute(f"PRAGMA {name} = {value}")
+    except Exception as e:
+        print(f"⚠️ 警告：恢复 SQLite 默认设置失败。错误信息: {e}")
+
+
+def _exclude_failed_sources(collection, stale_ids: list, failed_sources: list) -> list:
+    """
+    从待删除列表中剔除分块失败文档的知识块：这些文档本次没有生成知识块，
+    其旧知识块并非真正失效，删除后下次构建需要重新付费向量化。
+    元数据只记录文件名，同名文件的知识块也会被保留 (宁可多保留，不误删)；查询失败时不删除任何知识块。
+    """
+    failed_names = {os.path.basename(path) for path in failed_sources}
+    try:
+        data = collection.get(ids=stale_ids, include=["metadatas"])
+    except Exception as e:
+        print(f"⚠️ 警告：无法确认待删除知识块的来源，本次不删除任何知识块。错误信息: {e}")
+        return []
+
+    kept = [chunk_id for chunk_id, metadata in zip(data["ids"], data["metadatas"])
+            if (metadata or {}).get("source") not in failed_names]
+    if len(kept) < len(stale_ids):
+        print(f"-> 保留 {len(stale_ids) - len(kept)} 个属于分块失败文档的已入库知识块。")
+    return sorted(kept)
+
+
+def _make_progress_callback():
+    """
+    创建向量化进度回调，用 tqdm 在命令行显示批次进度 (进度条在首次回调时按总批次数创建)。
+    """
+    progress_bar = None
+
+    def _on_progress(done: int, total: int):
+        nonlocal progress_bar
+        if progress_bar is None:
+            progress_bar = tqdm(total=total, desc="向量化批次进度")
+        progress_bar.update(done - progress_bar.n)
+        if done >= total:
+            progress_bar.close()
 
-    def embed_query(self, text: str) -> List[float]:
-        """
-        实现 LangChain 要求的查询 Embedding 方法。
-        """
-        # 查询通常只有一条，不需要分批
-        return self.embed_documents([text])[0]
+    return _on_progress
 
 
 def build_index():
     """
     执行 RAG 索引构建的主流程：
-    1. 加载和处理文档。
-    2. 估算 Token 成本并请求用户确认。
-    3. 初始化 Embedding 模型（使用自定义 Wrapper）。
-    4. 创建 Chroma 向量数据库并存储数据。
+    1. 加载和处理文档 (未变化的文档复用分块缓存)。
+    2. 与 Chroma 集合比对，只保留尚未入库的知识块。
+    3. 估算 Token 成本并请求用户确认。
+    4. 初始化 Embedding 模型（使用自定义 Wrapper）。
+    5. 一次性并发向量化新增知识块。
+    6. 按批次写入 Chroma 向量数据库，并删除已失效的旧知识块。
     """
     print("=" * 60)
     print("🚀 悬浮 RAG 编程助手 - 知识索引构建工具")
@@ -93,71 +117,139 @@ def build_index():
         return
 
     # 2. 获取处理后的文档块
-    chunks = get_processed_chunks()
+    chunks, failed_sources = get_processed_chunks()
     if not chunks:
         print("索引构建中止。")
         return
 
-    # 3. Token 估算和确认
-    print("-> 正在估算 Token 数量...")
+    # 3. 打开 Chroma 集合并与现有数据比对 (chunk ID 由内容哈希得到，内容不变则 ID 不变)
     try:
-        # 使用 tiktoken 估算 Token
-        tokenizer = tiktoken.get_encoding("cl100k_base")
+        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        collection = client.get_or_create_collection(name=COLLECTION_NAME)
+        existing_ids = set(collection.get(include=[])["ids"])
+    except Exception as e:
+        print(f"❌ 错误：打开 ChromaDB 失败。错误信息: {e}")
+        return
 
-        all_text = [chunk.page_content for chunk in chunks]
-        token_counts = [len(tokenizer.encode(text)) for text in all_text]
-        total_tokens = sum(token_counts)
+    current_ids = {chunk.metadata["chunk_id"] for chunk in chunks}
+    new_chunks = [chunk for chunk in chunks if chunk.metadata["chunk_id"] not in existing_ids]
+    stale_ids = sorted(existing_ids - current_ids)
+    if failed_sources and stale_ids:
+        stale_ids = _exclude_failed_sources(collection, stale_ids, failed_sources)
 
+    if not new_chunks and not stale_ids:
+        print(f"✅ 索引已是最新，'{COLLECTION_NAME}' 集合中的 {len(existing_ids)} 个知识块无需更新。")
+        return
+
+    # 4. 两步确认：先确认知识块数量 (有待删除的知识块时明确确认删除数量)，
+    # 再估算 Token 并确认费用 (只有新增知识块需要向量化)
+    try:
         print("-" * 50)
         print(f"📝 索引任务总结:")
         print(f"   总知识块数量: {len(chunks)} 个")
-        print(f"   预计总 Token 数量 (用于 Embedding): {total_tokens:,} Tokens")
-        print(f"   使用的模型: {EMBEDDING_MODEL_NAME}")
+        print(f"   已入库并复用: {len(chunks) - len(new_chunks)} 个，新增: {len(new_chunks)} 个，待删除: {len(stale_ids)} 个")
         print("-" * 50)
 
-        # 请求用户确认
-        user_input = input("❓ 确认开始向量化 (这会产生 API 费用)？(输入 'Y' 或 'N'): ").strip().upper()
+        # 第一次确认：用户发现路径或分块配置有误时可立即退出，无需等待 Token 估算。
+        # 删除的向量需要重新付费才能恢复 (例如 DOCS_PATH 误指向部分文档时)，因此删除总是需要确认
+        if stale_ids:
+            question = f"❓ 将删除 {len(stale_ids)} 个知识块，是否继续？(输入 'Y' 或 'N'): "
+        else:
+            question = "❓ 是否继续估算 Token 数量？(输入 'Y' 或 'N'): "
+        user_input = input(question).strip().upper()
 
         if user_input != 'Y':
             print("🛑 用户取消了索引构建。")
             return
 
-    except ImportError:
-        print("⚠️ 警告：未安装 tiktoken 库，无法估算 Token。继续构建...")
+        if not new_chunks:
+            print("-> 没有新增知识块，无需向量化，仅删除失效的知识块。")
+        else:
+            print("-> 正在估算 Token 数量...")
+            total_tokens = count_tokens([chunk.page_content for chunk in new_chunks])
+
+            print("-" * 50)
+            print(f"   预计总 Token 数量 (用于 Embedding): {total_tokens:,} Tokens")
+            print(f"   使用的模型: {EMBEDDING_MODEL_NAME}")
+            print("-" * 50)
+
+            # 第二次确认：确认费用
+            user_input = input("❓ 确认开始向量化 (这会产生 API 费用)？(输入 'Y' 或 'N'): ").strip().upper()
+
+            if user_input != 'Y':
+                print("🛑 用户取消了索引构建。")
+                return
+
     except Exception as e:
         print(f"❌ 错误：Token 估算或用户确认失败。错误信息: {e}")
         return
 
-    # 4. 初始化 Embedding 模型
+    # 5. 初始化 Embedding 模型
     try:
         print(f"-> 正在初始化 OpenAI 兼容 Embedding 模型 (DashScope): {EMBEDDING_MODEL_NAME}...")
 
         embeddings = CustomDashScopeEmbeddings(
             model=EMBEDDING_MODEL_NAME,
             api_key=api_key,
-            base_url=DASHSCOPE_BASE_URL
+            base_url=DASHSCOPE_BASE_URL,
+            progress_callback=_make_progress_callback(),
+            checkpoint_path=EMBEDDING_CHECKPOINT_PATH
         )
         print("-> Embedding 模型初始化成功。")
     except Exception as e:
         print(f"❌ 错误：Embedding 模型初始化失败。请检查 API Key 和依赖库。错误信息: {e}")
         return
 
-    # 5. 创建 Chroma 向量数据库并存储
-    # 注意：Chroma.from_documents 在内部调用了 CustomDashScopeEmbeddings.embed_documents，
-    # 进度条已经在 embed_documents 中实现，无需在此处重复包装。
-    print(f"-> 正在创建和填充 Chroma 数据库到: {CHROMA_DB_PATH}...")
+    # 6. 预先计算新增知识块的向量 (embed_documents 内部并发分批，通过回调显示进度)
+    vectors = []
+    if new_chunks:
+        print(f"-> 正在向量化 {len(new_chunks)} 个知识块...")
+        try:
+            # 立即转换为连续的 float32 矩阵：List[List[float]] 每个分量约占 32 字节，矩阵仅 4 字节；
+            # 同时做 L2 归一化，使 L2 距离排序与余弦相似度一致
+            vectors = np.asarray(
+                embeddings.embed_documents([chunk.page_content for chunk in new_chunks]), dtype=np.float32
+            )
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.where(norms == 0, 1, norms)
+        except Exception as e:
+            print(f"❌ 错误：向量化失败，索引构建中止。错误信息: {e}")
+            return
+
+    # 7. 按 CHROMA_ADD_BATCH_SIZE 批量写入新增知识块，并删除已失效的旧知识块
+    print(f"-> 正在更新 Chroma 数据库: {CHROMA_DB_PATH}...")
     try:
-        Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=CHROMA_DB_PATH,
-            collection_name=COLLECTION_NAME
-        )
+        ids = [chunk.metadata["chunk_id"] for chunk in new_chunks]
+        documents = [chunk.page_content for chunk in new_chunks]
+        # Chroma 的元数据不接受 None 值，写入前剔除 (例如非 API 文档的 api_name)
+        metadatas = [{key: value for key, value in chunk.metadata.items() if value is not None}
+                     for chunk in new_chunks]
+
+        previous_pragmas = _apply_bulk_load_pragmas(client) if not existing_ids else {}
+        try:
+            for i in range(0, len(stale_ids), CHROMA_ADD_BATCH_SIZE):
+                collection.delete(ids=stale_ids[i:i + CHROMA_ADD_BATCH_SIZE])
+
+            for i in range(0, len(new_chunks), CHROMA_ADD_BATCH_SIZE):
+                collection.add(
+                    ids=ids[i:i + CHROMA_ADD_BATCH_SIZE],
+                    # 仅在写入时按批转换为列表，兼容只接受 list 的 Chroma 版本
+                    embeddings=vectors[i:i + CHROMA_ADD_BATCH_SIZE].tolist(),
+                    documents=documents[i:i + CHROMA_ADD_BATCH_SIZE],
+                    metadatas=metadatas[i:i + CHROMA_ADD_BATCH_SIZE]
+                )
+        finally:
+            _restore_pragmas(client, previous_pragmas)
 
+        # 向量已全部写入 Chroma，检查点不再需要
+        embeddings.clear_checkpoint()
         print("✅ 索引构建成功！")
-        print(f"共计 {len(chunks)} 个知识块已存储到 ChromaDB 的 '{COLLECTION_NAME}' 集合中。")
+        print(f"新增 {len(new_chunks)} 个、删除 {len(stale_ids)} 个知识块，"
+              f"'{COLLECTION_NAME}' 集合现有 {len(chunks)} 个知识块。")
     except Exception as e:
         print(f"❌ 错误：存储到 ChromaDB 失败。错误信息: {e}")
+        if new_chunks:
+            print(f"💾 已完成的向量保留在检查点 {EMBEDDING_CHECKPOINT_PATH}，重新运行无需再次付费向量化。")
         # 打印原始错误信息，帮助调试
         print(f"原始错误详情: {e}")
 
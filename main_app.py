@@ -7,7 +7,7 @@ from dotenv import load_dotenv
 # 导入 PyQt 核心和并发模块
 try:
     from PyQt6.QtWidgets import QApplication, QMessageBox
-    from PyQt6.QtCore import QTimer, pyqtSignal, QObject, QRunnable, QThreadPool, QSettings
+    from PyQt6.QtCore import pyqtSignal, QSettings
 except ImportError:
     print("❌ 错误：未找到 PyQt6 库。请确保已运行 'pip install PyQt6'")
     sys.exit(1)
@@ -24,52 +24,13 @@ from ui_module.shortcut_listener import ShortcutListener
 from ui_module.settings_window import SettingsWindow
 
 
-# --- 异步 RAG 任务工作器 ---
-
-class RAGWorkerSignals(QObject):
-    """定义 RAG 工作线程与主线程通信的信号。"""
-    finished = pyqtSignal(str)  # 任务完成，发送结果字符串
-    error = pyqtSignal(str)  # 任务失败，发送错误信息
-
-
-class RAGWorker(QRunnable):
-    """
-    QRunnable 封装 RAGEngine 的异步调用。
-    QRunnable 内部是同步执行的，但我们将用它来运行 asyncio 事件循环。
-    """
-
-    def __init__(self, engine: RAGEngine, query: str):
-        super().__init__()
-        self.engine = engine
-        self.query = query
-        self.signals = RAGWorkerSignals()
-
-    def run(self):
-        """
-        在 QThreadPool 提供的线程中启动 asyncio 事件循环并运行 RAG 任务。
-        """
-        try:
-            # 获取当前线程的事件循环，如果不存在则创建一个
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-
-            # 运行异步任务并同步等待结果
-            result = loop.run_until_complete(
-                self.engine.generate_answer(self.query)
-            )
-            self.signals.finished.emit(result)
-        except Exception as e:
-            # 捕获任何线程中的 LLM 或检索错误
-            self.signals.error.emit(f"RAG 任务失败: {e}")
-
-
 class RAGAssistantApp(QApplication):
     """
     RAG 助手应用程序的主控制类。
     """
+    # 信号：后台事件循环中的 RAG 任务通过信号排队投递回 Qt 主线程
+    token_received = pyqtSignal(str)  # 流式生成的每个 Token
+    answer_ready = pyqtSignal(str)  # 任务结束，发送完整答案 (或错误信息)
 
     def __init__(self, argv):
         super().__init__(argv)
@@ -77,8 +38,13 @@ class RAGAssistantApp(QApplication):
         # 1. 初始化设置和配置
         self.settings = QSettings(SETTINGS_FILE, QSettings.Format.IniFormat)
         self.current_config = self._load_initial_config()
-        self.threadpool = QThreadPool.globalInstance()
-        self.threadpool.setMaxThreadCount(2)  # 限制线程数
+
+        # 在单个后台线程中常驻一个 asyncio 事件循环，所有 RAG 协程都提交到这里并发执行，
+        # 避免每次查询重新创建事件循环，也不受线程池槽位限制
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_event_loop, daemon=True)
+        self._loop_thread.start()
+        self.aboutToQuit.connect(self._stop_event_loop)
 
         # 2. 初始化核心 RAG 组件
         print("--- 正在初始化 RAG 核心服务 ---")
@@ -87,23 +53,26 @@ class RAGAssistantApp(QApplication):
 
         # 3. 初始化 UI
         self.floating_window = FloatingWindow(self.rag_engine)
-        self.settings_window = SettingsWindow()
+        # 设置窗口在首次打开时才创建，启动时不构建其控件、不读取设置
+        self._settings_win = None
 
-        # 4. 初始化全局快捷键监听
-        self.shortcut_listener = ShortcutListener()
+        # 4. 初始化全局快捷键监听 (原生热键注册到悬浮窗口的窗口句柄上)
+        self.shortcut_listener = ShortcutListener(int(self.floating_window.winId()))
 
         # 5. 应用初始配置
         self._apply_config(self.current_config)
 
         # 6. 连接信号和槽
         self.floating_window.query_submitted.connect(self._handle_query)
+        self.token_received.connect(self.floating_window.append_token)
+        self.answer_ready.connect(self.floating_window.update_result)
         # 连接打开设置窗口的信号
-        self.floating_window.open_settings.connect(self.settings_window.show)
+        self.floating_window.open_settings.connect(self._open_settings)
         self.shortcut_listener.shortcut_pressed.connect(self.floating_window.toggle_visibility)
-        self.settings_window.settings_updated.connect(self._handle_settings_update)
 
         # 7. 启动快捷键监听
         self.shortcut_listener.start()
+        self.aboutToQuit.connect(self.shortcut_listener.stop)
 
         # 初始时隐藏窗口
         self.floating_window.hide_window()
@@ -116,7 +85,7 @@ class RAGAssistantApp(QApplication):
             "model": self.settings.value("LLM_MODEL_NAME", DEFAULT_LLM_MODEL_NAME),
             "url": self.settings.value("LLM_BASE_URL", DEFAULT_LLM_BASE_URL),
             # 注意类型转换
-            "k": int(self.settings.value("RETRIEVAL_K", DEFAULT_RETRIEVAL_K)),
+            "k": self.settings.value("RETRIEVAL_K", DEFAULT_RETRIEVAL_K, type=int),
             "theme": self.settings.value("THEME", DEFAULT_THEME)
         }
 
@@ -124,11 +93,11 @@ class RAGAssistantApp(QApplication):
         """应用配置到 RAGEngine 和 UI."""
         try:
             k = int(config.get("k", DEFAULT_RETRIEVAL_K))
-            # 重新配置 RAG 引擎
-            self.rag_engine.configure(
+            # 重新配置 RAG 引擎 (LLM 与检索各自判断是否变化，只修改 K 时不会重建 LLM)
+            self.rag_engine.configure_retrieval(k_value=k)
+            self.rag_engine.configure_llm(
                 llm_model_name=config.get("model", DEFAULT_LLM_MODEL_NAME),
-                llm_base_url=config.get("url", DEFAULT_LLM_BASE_URL),
-                k_value=k
+                llm_base_url=config.get("url", DEFAULT_LLM_BASE_URL)
             )
             # 更新 UI 主题
             self.floating_window.update_theme(config.get("theme", DEFAULT_THEME))
@@ -140,23 +109,54 @@ class RAGAssistantApp(QApplication):
                 f"无法应用 RAG 配置。请检查 Ollama 模型名称或 Base URL 是否正确。错误: {e}"
             )
 
-    def _handle_settings_update(self):
+    def _open_settings(self):
+        """打开设置窗口 (首次打开时创建)。"""
+        if self._settings_win is None:
+            self._settings_win = SettingsWindow()
+            self._settings_win.settings_updated.connect(self._reload_settings_cache)
+        self._settings_win.show()
+
+    def _reload_settings_cache(self):
         """处理设置窗口发出的更新信号。"""
-        new_config = self.settings_window.get_current_settings()
+        new_config = self._settings_win.get_current_settings()
         self._apply_config(new_config)
 
+    def _run_event_loop(self):
+        """后台线程入口：运行常驻事件循环直到应用退出。"""
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _stop_event_loop(self):
+        """应用退出时停止后台事件循环。"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
     def _handle_query(self, query: str):
         """
-        处理 UI 提交的查询，并将异步 RAG 任务提交给线程池。
+        处理 UI 提交的查询，将 RAG 协程提交到后台事件循环。
         """
-        worker = RAGWorker(self.rag_engine, query)
+        future = asyncio.run_coroutine_threadsafe(self._stream_answer(query), self._loop)
+        future.add_done_callback(self._on_query_done)
 
-        # 连接信号
-        worker.signals.finished.connect(self.floating_window.update_result)
-        worker.signals.error.connect(self.floating_window.update_result)
+    async def _stream_answer(self, query: str) -> str:
+        """
+        在后台事件循环中运行：逐 Token 推送到 UI，并返回拼接后的完整答案。
+        """
+        parts = []
+        async for token in self.rag_engine.astream_answer(query):
+            parts.append(token)
+            self.token_received.emit(token)
+        return "".join(parts)
 
-        # 将 QRunnable 提交给线程池。
-        self.threadpool.start(worker)
+    def _on_query_done(self, future):
+        """
+        在事件循环线程中回调。跨线程 emit 会自动以排队方式投递到 Qt 主线程。
+        """
+        try:
+            result = future.result()
+        except Exception as e:
+            # 捕获任何 LLM 或检索错误
+            result = f"RAG 任务失败: {e}"
+        self.answer_ready.emit(result)
 
 
 def main():
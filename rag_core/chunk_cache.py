@@ -0,0 +1,82 @@
+import os
+import pickle
+from typing import Dict, List, Optional
+from langchain_core.documents import Document
+
+from rag_core.config import (
+    CHUNK_CACHE_PATH, TOKENIZER_ENCODING, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS
+)
+
+# 缓存格式版本；分块逻辑或元数据结构变化时递增，使旧缓存整体失效
+CACHE_VERSION = 1
+
+
+class ChunkCache:
+    """
+    按源文件缓存分块结果，键为文件路径，值为 {'mtime', 'size', 'chunks'}。
+    文件的修改时间和大小都未变化时直接复用缓存的知识块，只有变化的文档需要重新分块。
+    """
+
+    def __init__(self, path: str = CHUNK_CACHE_PATH):
+        self.path = path
+        # 分块参数变化后缓存的结果不再有效，因此将其作为缓存签名的一部分
+        self.signature = (CACHE_VERSION, TOKENIZER_ENCODING, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS)
+        self.entries: Dict[str, dict] = self._load()
+
+    def _load(self) -> Dict[str, dict]:
+        """从磁盘读取缓存；文件不存在、损坏或签名不一致时返回空缓存。"""
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️ 警告：分块缓存读取失败，将重新分块所有文档。错误信息: {e}")
+            return {}
+
+        if not isinstance(data, dict) or data.get("signature") != self.signature:
+            print("-> 分块参数已变化，忽略旧的分块缓存。")
+            return {}
+        return data.get("entries", {})
+
+    def get(self, source_path: str) -> Optional[List[Document]]:
+        """返回未变化文件的缓存知识块；未命中时返回 None。"""
+        entry = self.entries.get(source_path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return None
+        if entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            return None
+        return entry["chunks"]
+
+    def put(self, source_path: str, chunks: List[Document]):
+        """记录文件当前的 (mtime, size) 及其分块结果。"""
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return
+        self.entries[source_path] = {
+            "path": source_path,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "chunks": chunks,
+        }
+
+    def prune(self, live_paths: List[str]):
+        """丢弃已删除文件的缓存条目。"""
+        live = set(live_paths)
+        self.entries = {path: entry for path, entry in self.entries.items() if path in live}
+
+    def save(self):
+        """原子地写回磁盘 (先写临时文件再替换)，中途失败不会破坏旧缓存。"""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"signature": self.signature, "entries": self.entries}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"⚠️ 警告：分块缓存写入失败，下次构建将重新分块。错误信息: {e}")
@@ -12,6 +12,12 @@ DOCS_PATH = os.path.join(os.path.dirname(__file__), '..', 'pandas_docs')
 # 本地 ChromaDB 存储路径
 CHROMA_DB_PATH = os.path.join(os.path.dirname(__file__), 'chroma_db')
 
+# 分块结果缓存文件 (按源文件 mtime/size 复用，加速增量构建)
+CHUNK_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'chunks_cache.pkl')
+
+# 向量化检查点文件 (构建中途失败时保存已完成的向量，重新运行可从断点继续)
+EMBEDDING_CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), 'embedding_checkpoint.pkl')
+
 # ChromaDB Collection 名称
 COLLECTION_NAME = "pandas_api_reference"
 
@@ -31,8 +37,16 @@ RST_HEADERS_TO_SPLIT_BY = [
     (r"\n(={3,}|-{3,}|~{3,})\n", "Header"),
     (r"\n.. code-block:: python\n", "CodeBlock"),
 ]
-CHUNK_SIZE = 1000  # 字符数
-CHUNK_OVERLAP = 200 # 字符重叠
+# 分块与 Token 计费共用同一个 tiktoken 编码
+TOKENIZER_ENCODING = "cl100k_base"
+CHUNK_SIZE_TOKENS = 300  # Token 数
+CHUNK_OVERLAP_TOKENS = 60 # Token 重叠
+
+# --- 索引性能配置 (Indexing) ---
+# 并发读取文档的线程数 (I/O 密集，线程数可高于 CPU 核数)
+LOADER_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# 并行分块的进程数 (CPU 密集，与核数一致)；Windows 上 ProcessPoolExecutor 最多支持 61 个进程，超过会抛出 ValueError
+SPLIT_MAX_WORKERS = min(61, os.cpu_count() or 1)
 
 # --- RAG 检索配置 (Retrieval) ---
 # K 值：默认值 (实际运行时从 QSettings 加载)
@@ -1,51 +1,276 @@
 import os
-from typing import List
-from openai import OpenAI
+import asyncio
+import hashlib
+import importlib.util
+import pickle
+import random
+from typing import Callable, Dict, List, Optional
+import httpx
+from openai import (
+    OpenAI, AsyncOpenAI,
+    APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+)
 from langchain_core.embeddings import Embeddings as BaseEmbeddings
 
 # 定义阿里云 DashScope 兼容模式的 Base URL
 DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 # DashScope 官方限制 BATCH_SIZE 最大为 10
 BATCH_SIZE = 10
+# 同时在途的批次请求上限 (DashScope 通常允许 5-10 个并发)
+MAX_CONCURRENT_REQUESTS = 8
+
+# httpx 的 HTTP/2 支持依赖可选的 h2 包 (pip install "httpx[http2]")；未安装时回退到 HTTP/1.1 keep-alive
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+# 长连接池：多个批次请求复用同一 TLS 连接 (HTTP/2 下可多路复用)
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# 单个批次的最大尝试次数；仅对限流、超时、连接错误和服务端 5xx 重试
+MAX_BATCH_ATTEMPTS = 5
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+# 每完成多少个批次向检查点文件追加一次已完成的向量
+CHECKPOINT_EVERY_BATCHES = 50
 
 class CustomDashScopeEmbeddings(BaseEmbeddings):
     """
-    自定义的 Embedding 包装器，用于使用原生的 openai.OpenAI 客户端
+    自定义的 Embedding 包装器，用于使用原生的 openai 客户端
     调用阿里云 DashScope 的兼容 API。
+    文档向量化使用 AsyncOpenAI 并发发送各批次请求，查询向量化使用同步客户端。
     """
 
-    def __init__(self, model: str, api_key: str, base_url: str = DASHSCOPE_BASE_URL):
+    def __init__(self, model: str, api_key: str, base_url: str = DASHSCOPE_BASE_URL,
+                 max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 checkpoint_path: Optional[str] = None):
         self.model = model
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        # 进度回调 (已完成批次数, 总批次数)：命令行可传入更新 tqdm 的函数，UI 可传入发射 Qt 信号的函数
+        self.progress_callback = progress_callback
+        # 检查点文件：长时间向量化中途失败时保存已完成的向量，重新运行可从断点继续
+        self.checkpoint_path = checkpoint_path
+        self.client = OpenAI(
+            api_key=api_key, base_url=base_url,
+            http_client=httpx.Client(http2=HTTP2_ENABLED, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        )
+        # 仅供 aembed_query 在主应用的常驻事件循环中复用连接
+        self.async_client = self._new_async_client()
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def _new_async_client(self, max_retries: int = 2) -> AsyncOpenAI:
+        """创建使用 HTTP/2 长连接池的 AsyncOpenAI 客户端。"""
+        return AsyncOpenAI(
+            api_key=self.api_key, base_url=self.base_url, max_retries=max_retries,
+            http_client=httpx.AsyncClient(http2=HTTP2_ENABLED, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        )
+
+    # --- 检查点 ---
+    def _load_checkpoint(self) -> Dict[bytes, List[float]]:
         """
-        实现 LangChain 要求的文档 Embedding 方法，并强制进行分批处理。
+        读取检查点中已完成的向量 {文本摘要: 向量}。文件由多条追加写入的 pickle 记录组成，
+        第一条记录是模型名称。之后的记录会追加在文件末尾，因此读取时顺便修复文件：
+        模型不一致或文件头无法读取时删除文件，末尾有不完整的记录时截断到最后一条完整记录。
         """
-        all_embeddings: List[List[float]] = []
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
 
-        # 在应用运行时，这个方法通常只用于 build_index.py，但在 db_manager
-        # 中用于检索（单查询）时也会间接调用，所以我们保持其稳健性。
+        completed: Dict[bytes, List[float]] = {}
+        header_ok = False
+        valid_end = 0  # 最后一条完整记录的结束位置
+        try:
+            with open(self.checkpoint_path, "rb") as f:
+                header_ok = pickle.load(f) == {"model": self.model}
+                valid_end = f.tell()
+                while header_ok:
+                    completed.update(pickle.load(f))
+                    valid_end = f.tell()
+        except EOFError:
+            pass
+        except Exception as e:
+            print(f"⚠️ 警告：检查点文件部分损坏，仅恢复可读取的 {len(completed)} 个向量。错误信息: {e}")
+
+        if not header_ok:
+            # 否则新模型的向量会追加在旧模型的文件头之后，两种模型的向量混在一起
+            print("-> 检查点来自其他 Embedding 模型或无法读取，已删除。")
+            self.clear_checkpoint()
+            return {}
+        if valid_end != os.path.getsize(self.checkpoint_path):
+            # 中断时写了一半的记录会让之后追加的记录都无法读出
+            os.truncate(self.checkpoint_path, valid_end)
+        return completed
+
+    def _append_checkpoint(self, entries: Dict[bytes, List[float]]):
+        """将新完成的向量追加到检查点文件 (新文件先写入模型名称)。"""
+        if not self.checkpoint_path or not entries:
+            return
+        try:
+            is_new = not os.path.exists(self.checkpoint_path)
+            with open(self.checkpoint_path, "ab") as f:
+                if is_new:
+                    pickle.dump({"model": self.model}, f)
+                pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f"⚠️ 警告：写入检查点失败。错误信息: {e}")
+
+    def clear_checkpoint(self):
+        """
+        删除检查点文件。向量化完成后检查点仍然保留，调用方应在向量全部写入向量库之后再调用，
+        否则写入失败时已付费的向量会丢失。
+        """
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
 
-        for i in range(0, len(texts), BATCH_SIZE):
-            batch = texts[i:i + BATCH_SIZE]
+    # --- 文档向量化 ---
+    async def _create_with_retry(self, client: AsyncOpenAI, batch: List[str], batch_index: int):
+        """
+        请求单个批次。可重试的错误按带随机抖动的指数退避重试，
+        超过 MAX_BATCH_ATTEMPTS 次或遇到不可重试的错误时抛出。
+        """
+        for attempt in range(MAX_BATCH_ATTEMPTS):
             try:
-                response = self.client.embeddings.create(
+                return await client.embeddings.create(
                     model=self.model,
                     input=batch
                 )
-                batch_embeddings = [data.embedding for data in response.data]
-                all_embeddings.extend(batch_embeddings)
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_BATCH_ATTEMPTS - 1:
+                    print(f"❌ 警告：Embedding 过程中，批次 {batch_index} 重试 {MAX_BATCH_ATTEMPTS} 次后仍失败。错误信息: {e}")
+                    raise
+                delay = min(30.0, 0.5 * 2 ** attempt) + random.random()
+                print(f"⚠️ 批次 {batch_index} 第 {attempt + 1} 次请求失败，{delay:.1f} 秒后重试。错误信息: {e}")
+                await asyncio.sleep(delay)
             except Exception as e:
-                print(f"❌ DashScope Embedding API 调用失败。错误信息: {e}")
-                # 重新抛出异常，让上层捕获处理
-                raise e
+                print(f"❌ 警告：Embedding 过程中，批次 {batch_index} 失败。错误信息: {e}")
+                raise
+
+    async def _aembed_batches(self, client: AsyncOpenAI, texts: List[str],
+                              all_embeddings: List[Optional[List[float]]],
+                              on_batch_done: Optional[Callable[[int], None]] = None):
+        """
+        将 texts 按 BATCH_SIZE 切分，并发请求各批次，结果按原始顺序写入预分配的 all_embeddings。
+        中途失败时 all_embeddings 中保留已完成批次的结果，供调用方写入检查点。
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        total_batches = (len(texts) + BATCH_SIZE - 1) // BATCH_SIZE
+        done_batches = 0
+
+        async def _embed_batch(start: int):
+            nonlocal done_batches
+            batch = texts[start:start + BATCH_SIZE]
+            # 退避等待期间继续占用并发槽位，限流时自然降低请求速率
+            async with semaphore:
+                response = await self._create_with_retry(client, batch, start // BATCH_SIZE)
+            all_embeddings[start:start + len(batch)] = [data.embedding for data in response.data]
+
+            done_batches += 1
+            if on_batch_done is not None:
+                on_batch_done(done_batches)
+            if self.progress_callback is not None:
+                self.progress_callback(done_batches, total_batches)
+
+        await asyncio.gather(*(_embed_batch(i) for i in range(0, len(texts), BATCH_SIZE)))
 
-        return all_embeddings
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        异步版本的文档 Embedding 方法。每次调用使用独立的 AsyncOpenAI 客户端，
+        避免连接池跨事件循环复用。
+        """
+        # 去重：文档中的样板内容常被切成完全相同的知识块，相同文本只请求一次
+        seen: Dict[bytes, int] = {}
+        unique_texts: List[str] = []
+        digests: List[bytes] = []
+        indices: List[int] = []
+        for text in texts:
+            digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+            if digest not in seen:
+                seen[digest] = len(unique_texts)
+                unique_texts.append(text)
+                digests.append(digest)
+            indices.append(seen[digest])
+
+        duplicates = len(texts) - len(unique_texts)
+        if duplicates:
+            print(f"-> 发现 {duplicates} 个重复文本 ({duplicates / len(texts):.1%})，"
+                  f"实际只需向量化 {len(unique_texts)} 个。")
+
+        # 从检查点恢复上次已完成的向量，只请求剩余的文本
+        completed = self._load_checkpoint()
+        pending = [i for i, digest in enumerate(digests) if digest not in completed]
+        if len(pending) < len(unique_texts):
+            print(f"-> 从检查点恢复 {len(unique_texts) - len(pending)} 个已完成的向量。")
+
+        pending_texts = [unique_texts[i] for i in pending]
+        pending_embeddings: List[Optional[List[float]]] = [None] * len(pending)
+        saved = [False] * len(pending)
+
+        def _save_progress():
+            new_entries = {}
+            for j, embedding in enumerate(pending_embeddings):
+                if embedding is not None and not saved[j]:
+                    new_entries[digests[pending[j]]] = embedding
+                    saved[j] = True
+            self._append_checkpoint(new_entries)
+
+        def _on_batch_done(done_batches: int):
+            if self.checkpoint_path and done_batches % CHECKPOINT_EVERY_BATCHES == 0:
+                _save_progress()
+
+        try:
+            # 重试由 _create_with_retry 负责，关闭客户端自带的重试以免叠加
+            async with self._new_async_client(max_retries=0) as client:
+                await self._aembed_batches(client, pending_texts, pending_embeddings, _on_batch_done)
+        except BaseException:
+            # 包括 Ctrl+C (KeyboardInterrupt / CancelledError)，这是长时间构建最常见的中断方式
+            if self.checkpoint_path:
+                _save_progress()
+                print(f"💾 已完成的向量已保存到检查点 {self.checkpoint_path}，重新运行即可从断点继续。")
+            raise
+
+        # 剩余未写入检查点的向量也保存下来，直到调用方写入向量库后调用 clear_checkpoint
+        if self.checkpoint_path:
+            _save_progress()
+        for j, embedding in enumerate(pending_embeddings):
+            completed[digests[pending[j]]] = embedding
+
+        # 按原始顺序展开回每个输入文本
+        return [completed[digests[i]] for i in indices]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        实现 LangChain 要求的文档 Embedding 方法，并强制进行分批处理。
+        向量化是纯网络 I/O，因此在独立事件循环中并发发送各批次请求。
+        """
+        if not texts:
+            return []
+        return asyncio.run(self.aembed_documents(texts))
 
     def embed_query(self, text: str) -> List[float]:
         """
         实现 LangChain 要求的查询 Embedding 方法 (db_manager 依赖此方法)。
+        检索可能发生在已运行的事件循环中，因此这里使用同步客户端，不经过 asyncio.run。
         """
         # 查询通常只有一条，不需要分批
-        return self.embed_documents([text])[0]
\ No newline at end of file
+        try:
+            response = self.client.embeddings.create(
+                model=self.model,
+                input=[text]
+            )
+        except Exception as e:
+            print(f"❌ DashScope Embedding API 调用失败。错误信息: {e}")
+            # 重新抛出异常，让上层捕获处理
+            raise e
+        return response.data[0].embedding
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        异步查询 Embedding，等待网络 I/O 时不阻塞事件循环中的其他查询。
+        """
+        try:
+            response = await self.async_client.embeddings.create(
+                model=self.model,
+                input=[text]
+            )
+        except Exception as e:
+            print(f"❌ DashScope Embedding API 调用失败。错误信息: {e}")
+            raise e
+        return response.data[0].embedding
@@ -1,5 +1,9 @@
 import os
-from typing import List
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import numpy as np
 from dotenv import load_dotenv
 from langchain_core.documents import Document
 from langchain_community.vectorstores import Chroma
@@ -13,8 +17,26 @@ class DBManager:
     封装 ChromaDB 的加载和查询（检索）逻辑。
     负责将用户查询向量化，并从持久化的向量库中检索相关文档块。
     """
+    # 查询向量 LRU 缓存容量：重复查询可省去一次 DashScope 网络往返
+    EMBEDDING_CACHE_SIZE = 512
+    # 知识块数量不超过该值时，使用内存中的向量矩阵暴力检索，否则回退到 Chroma 的 HNSW 检索
+    BRUTE_FORCE_MAX_CHUNKS = 100_000
+    # 暴力检索时每次转换为 float32 参与矩阵乘法的行数，控制临时内存占用
+    SCORE_BLOCK_ROWS = 8192
 
     def __init__(self):
+        # 查询文本 -> 向量 的 LRU 缓存 (同步与异步检索共用，加锁保证线程安全)
+        self._embedding_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # 暴力检索用的向量矩阵 (N, d)，首次检索时懒加载；行已 L2 归一化并以 float16 存储
+        # 三者作为一个元组 (矩阵, 文本列表, 元数据列表) 整体替换，重新加载时并发的检索仍使用完整的旧数据
+        self._matrix_data: Optional[Tuple[np.ndarray, List[str], List[dict]]] = None
+        self._matrix_loaded = False
+        # 加载矩阵时 Chroma 数据文件的状态；build_index.py 更新集合后会变化，据此重新加载
+        self._matrix_stamp = None
+        self._matrix_lock = threading.Lock()
+
         # 1. 加载环境变量
         load_dotenv()
         dashscope_api_key = os.getenv("DASHSCOPE_API_KEY")
@@ -51,6 +73,133 @@ class DBManager:
             print(f"❌ DBManager: ChromaDB 加载或初始化失败。请先运行 build_index.py。错误: {e}")
             self.db = None
 
+    def _get_cached_embedding(self, query: str) -> Optional[List[float]]:
+        """命中时返回缓存的查询向量，并将其标记为最近使用。"""
+        with self._cache_lock:
+            embedding = self._embedding_cache.get(query)
+            if embedding is not None:
+                self._embedding_cache.move_to_end(query)
+            return embedding
+
+    def _cache_embedding(self, query: str, embedding: List[float]):
+        """写入查询向量，超出容量时淘汰最久未使用的条目。"""
+        with self._cache_lock:
+            self._embedding_cache[query] = embedding
+            self._embedding_cache.move_to_end(query)
+            if len(self._embedding_cache) > self.EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+
+    def _embed_query(self, query: str) -> List[float]:
+        embedding = self._get_cached_embedding(query)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+            self._cache_embedding(query, embedding)
+        return embedding
+
+    async def _aembed_query(self, query: str) -> List[float]:
+        embedding = self._get_cached_embedding(query)
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(query)
+            self._cache_embedding(query, embedding)
+        return embedding
+
+    def _query_collection(self, query_embedding: List[float], k: int) -> List[Document]:
+        """
+        直接调用底层 Chroma 集合检索，跳过 LangChain 的 similarity_search 包装 (及其重复的查询向量化)。
+        """
+        results = self.db._collection.query(
+            query_embeddings=[query_embedding],
+            n_results=k,
+            include=["documents", "metadatas"]
+        )
+        return [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(results["documents"][0], results["metadatas"][0])
+        ]
+
+    @staticmethod
+    def _collection_stamp():
+        """
+        返回 Chroma SQLite 数据文件 (含 -wal 等附属文件) 的 (文件名, 修改时间, 大小)。
+        任何写入 (包括 build_index.py 在其他进程中的增量更新) 都会改变该值，每次检索只需几次 stat。
+        """
+        try:
+            return tuple(
+                (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in sorted(os.scandir(CHROMA_DB_PATH), key=lambda e: e.name)
+                if entry.name.startswith("chroma.sqlite3")
+            )
+        except OSError:
+            return None
+
+    def _ensure_matrix(self) -> Optional[Tuple[np.ndarray, List[str], List[dict]]]:
+        """
+        懒加载所有知识块的向量为连续的 float16 矩阵，返回 (矩阵, 文本列表, 元数据列表)。
+        数据文件未变化时复用已加载的结果 (包括不可用的结论)；重新构建索引后自动重新加载，
+        无需重启应用。集合为空、过大或加载失败时返回 None，由调用方回退到 Chroma。
+        """
+        stamp = self._collection_stamp()
+        with self._matrix_lock:
+            if self._matrix_loaded and stamp == self._matrix_stamp:
+                return self._matrix_data
+            if self._matrix_loaded:
+                print("-> DBManager: 检测到向量库已更新，重新加载向量矩阵。")
+            self._matrix_loaded = True
+            self._matrix_stamp = stamp
+            self._matrix_data = None
+
+            try:
+                collection = self.db._collection
+                count = collection.count()
+                if count == 0 or count > self.BRUTE_FORCE_MAX_CHUNKS:
+                    return None
+
+                data = collection.get(include=["embeddings", "documents", "metadatas"])
+                matrix = np.asarray(data["embeddings"], dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix /= np.where(norms == 0, 1, norms)
+
+                self._matrix_data = (
+                    np.ascontiguousarray(matrix, dtype=np.float16),
+                    list(data["documents"]),
+                    [metadata or {} for metadata in data["metadatas"]],
+                )
+                print(f"✅ DBManager: 已加载 {count} 个知识块的向量矩阵，使用内存暴力检索。")
+                return self._matrix_data
+            except Exception as e:
+                print(f"⚠️ DBManager: 向量矩阵加载失败，回退到 Chroma 检索。错误: {e}")
+                return None
+
+    def _search_matrix(self, matrix_data: Tuple[np.ndarray, List[str], List[dict]],
+                       query_embedding: List[float], k: int) -> List[Document]:
+        """
+        在内存矩阵上计算余弦相似度并取 Top-K。
+        numpy 的 float16 矩阵乘法没有 BLAS 实现，因此按块转换为 float32 再走 SGEMV。
+        """
+        matrix, documents, metadatas = matrix_data
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), self.SCORE_BLOCK_ROWS):
+            block = matrix[start:start + self.SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            Document(page_content=documents[i], metadata=metadatas[i])
+            for i in top
+        ]
+
+    def _search(self, query_embedding: List[float], k: int) -> List[Document]:
+        """优先使用内存矩阵检索，不可用时回退到 Chroma。"""
+        matrix_data = self._ensure_matrix()
+        if matrix_data is not None:
+            return self._search_matrix(matrix_data, query_embedding, k)
+        return self._query_collection(query_embedding, k)
+
     def retrieve_documents(self, query: str, k: int) -> List[Document]:
         """
         从向量数据库中检索最相关的文档块，k 值由调用者 (RAGEngine) 传入。
@@ -60,10 +209,27 @@ class DBManager:
             return []
 
         try:
-            # 使用 similarity_search 替代 retriever.invoke，以支持动态 K
-            documents = self.db.similarity_search(query, k=k)
+            documents = self._search(self._embed_query(query), k)
+            print(f"🔎 检索到 {len(documents)} 个相关文档块 (K={k})。")
+            return documents
+        except Exception as e:
+            print(f"❌ 检索过程中发生错误。错误: {e}")
+            return []
+
+    async def aretrieve_documents(self, query: str, k: int) -> List[Document]:
+        """
+        retrieve_documents 的异步版本：查询向量化走异步 HTTP，
+        向量检索放到工作线程执行，两者都不阻塞事件循环。
+        """
+        if not self.db:
+            print("❌ 数据库未初始化，无法执行检索。")
+            return []
+
+        try:
+            query_embedding = await self._aembed_query(query)
+            documents = await asyncio.to_thread(self._search, query_embedding, k)
             print(f"🔎 检索到 {len(documents)} 个相关文档块 (K={k})。")
             return documents
         except Exception as e:
             print(f"❌ 检索过程中发生错误。错误: {e}")
-            return []
\ No newline at end of file
+            return []
@@ -1,37 +1,64 @@
 import os
-from typing import List
+import re
+import glob
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
 from tqdm import tqdm  # 导入 tqdm 库
+import tiktoken
 
 # 核心模块导入：LangChain 0.2.x 架构
 from langchain_core.documents import Document
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
 # 最终修复：使用 LangChain 最新版本中最常用的导入路径。
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # 从 config.py 导入配置
-from rag_core.config import DOCS_PATH, RST_HEADERS_TO_SPLIT_BY, CHUNK_SIZE, CHUNK_OVERLAP
+from rag_core.config import (
+    DOCS_PATH, RST_HEADERS_TO_SPLIT_BY, TOKENIZER_ENCODING, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS,
+    LOADER_MAX_WORKERS, SPLIT_MAX_WORKERS
+)
+from rag_core.chunk_cache import ChunkCache
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer() -> tiktoken.Encoding:
+    """
+    返回进程内共享的 tiktoken 编码对象，分块和 Token 估算复用同一实例。
+    """
+    return tiktoken.get_encoding(TOKENIZER_ENCODING)
+
+
+def count_tokens(texts: List[str]) -> int:
+    """
+    批量统计文本的 Token 总数 (多线程编码，无需扫描特殊 Token)。
+    """
+    return sum(map(len, get_tokenizer().encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)))
 
 
 # --------------------
 # 1. 定制加载器
 # --------------------
 
+def _read_document(path: str) -> Document:
+    """读取单个文件为 Document，元数据格式与 TextLoader 保持一致。"""
+    return Document(page_content=Path(path).read_text(encoding='utf-8'), metadata={'source': path})
+
+
 def load_documents() -> List[Document]:
     """
     递归加载 DOCS_PATH 下所有 .rst.txt 文件，并附带原始元数据。
+    读取和 UTF-8 解码以 I/O 为主，使用线程池并发读取，跳过 DirectoryLoader 的逐文件包装。
     """
     print(f"-> 正在从目录: {DOCS_PATH} 递归加载文档...")
 
     try:
-        # 修复：通过 loader_kwargs 明确指定编码为 'utf-8'
-        loader = DirectoryLoader(
-            DOCS_PATH,
-            glob="**/*.rst.txt",
-            loader_cls=TextLoader,
-            loader_kwargs={'encoding': 'utf-8'},
-            recursive=True
-        )
-        documents = loader.load()
+        # 排序保证文档顺序 (以及后续 chunk 序号) 在多次构建间保持一致
+        paths = sorted(glob.iglob(os.path.join(DOCS_PATH, "**", "*.rst.txt"), recursive=True))
+        with ThreadPoolExecutor(max_workers=LOADER_MAX_WORKERS) as executor:
+            # executor.map 按输入顺序返回结果
+            documents = list(tqdm(executor.map(_read_document, paths), total=len(paths), desc="文档加载进度"))
         print(f"-> 文档加载完成，共计 {len(documents)} 个原始文档。")
         return documents
     except Exception as e:
@@ -43,117 +70,174 @@ def load_documents() -> List[Document]:
 # 2. 元数据和分块函数
 # --------------------
 
+# 一次正则匹配即可确定文档类型，按路径片段映射到 doc_type。
+# 只匹配相对于 DOCS_PATH 的路径，避免项目所在的上级目录名 (如 ~/development/) 干扰分类
+_DOC_TYPE_RE = re.compile(r"reference/api|getting_started|user_guide|development")
+_DOC_TYPE_MAP = {
+    "reference/api": "API_REFERENCE",
+    "getting_started": "TUTORIAL_GUIDE",
+    "user_guide": "TUTORIAL_GUIDE",
+    "development": "DEVELOPMENT_GUIDE",
+}
+
+
 def _extract_metadata(doc: Document) -> dict:
     """
     根据文件路径和内容提取结构化元数据。
     """
     source_path = doc.metadata.get('source', '')
+    filename = os.path.basename(source_path)
 
     metadata = {
-        "source": os.path.basename(source_path),
+        "source": filename,
         "doc_type": "GENERAL",
         "api_name": None
     }
 
-    # 将路径标准化为斜杠，方便检查
-    normalized_path = source_path.replace(os.sep, '/')
-
-    if 'reference/api' in normalized_path:
-        metadata["doc_type"] = "API_REFERENCE"
-        # 尝试从文件名提取 API 名称 (e.g., pandas.DataFrame.agg.rst.txt)
-        try:
-            filename = os.path.basename(source_path)
-            # 去除 .rst.txt 后缀
-            api_name = filename.replace('.rst.txt', '')
-            metadata["api_name"] = api_name
-        except:
-            pass
-    elif 'getting_started' in normalized_path or 'user_guide' in normalized_path:
-        metadata["doc_type"] = "TUTORIAL_GUIDE"
-    elif 'development' in normalized_path:
-        metadata["doc_type"] = "DEVELOPMENT_GUIDE"
+    # 取相对于文档根目录的路径，并标准化为斜杠，方便匹配
+    relative_path = os.path.relpath(source_path, DOCS_PATH)
+    if os.sep != '/':
+        relative_path = relative_path.replace(os.sep, '/')
 
-    return metadata
+    match = _DOC_TYPE_RE.search(relative_path)
+    if match:
+        metadata["doc_type"] = _DOC_TYPE_MAP[match.group(0)]
+        if metadata["doc_type"] == "API_REFERENCE":
+            # 从文件名提取 API 名称 (e.g., pandas.DataFrame.agg.rst.txt)
+            metadata["api_name"] = filename.removesuffix('.rst.txt')
 
+    return metadata
 
-def split_and_add_metadata(documents: List[Document]) -> List[Document]:
-    """
-    对文档进行结构化分块，并添加丰富的元数据。
-    """
-    all_chunks = []
 
-    # 使用 RecursiveCharacterTextSplitter，关闭正则表达式模式
+# 分隔符：使用 ReST 标题的字符（作为纯字符串），加上通用的换行和空格。
+_RST_SEPARATORS = ["\n=======================================\n",
+                   "\n---------------------------------------\n",
+                   "\n~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n",
+                   "\n.. code-block:: python\n"]
 
-    # 分隔符：使用 ReST 标题的字符（作为纯字符串），加上通用的换行和空格。
-    rst_separators = ["\n=======================================\n",
-                      "\n---------------------------------------\n",
-                      "\n~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n",
-                      "\n.. code-block:: python\n"]
+_SEPARATORS = _RST_SEPARATORS + ["\n\n", "\n", " "]
 
-    separators = rst_separators + ["\n\n", "\n", " "]
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=separators,
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
+@lru_cache(maxsize=None)
+def _get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """
+    构建分块器。每个进程只构建一次 (子进程在首次分块时创建自己的实例)。
+    """
+    # 按真实 Token 数分块 (等价于 from_tiktoken_encoder，但复用共享的编码对象)，
+    # 避免字符分块导致 Token 不均衡
+    tokenizer = get_tokenizer()
+    # 使用 RecursiveCharacterTextSplitter，关闭正则表达式模式
+    return RecursiveCharacterTextSplitter(
+        separators=_SEPARATORS,
+        chunk_size=CHUNK_SIZE_TOKENS,
+        chunk_overlap=CHUNK_OVERLAP_TOKENS,
+        length_function=lambda text: len(tokenizer.encode_ordinary(text)),
         # 默认 is_separator_regex=False，避免 list index out of range 错误
     )
 
-    print("-> 正在进行结构化分块和元数据提取...")
 
-    # 使用 tqdm 包装文档列表以显示进度
-    for i, doc in enumerate(tqdm(documents, desc="分块处理进度")):
-        # 提取基础元数据
-        base_metadata = _extract_metadata(doc)
-
-        # 1. 分割文档
-        try:
-            chunks = text_splitter.create_documents(
-                texts=[doc.page_content],
-                metadatas=[base_metadata]
-            )
-
-            # 检查分块结果是否有效
-            if not chunks or len(chunks) == 0:
-                # 使用 tqdm.write 避免进度条被干扰
-                tqdm.write(f"⚠️ 警告：文件 '{base_metadata.get('source', 'Unknown File')}' 分块后为空，已跳过。")
-                continue
+def _split_one(doc: Document) -> Tuple[dict, List[Document], Optional[str]]:
+    """
+    分块单个文档，在子进程中执行 (顶层函数以便 pickle)。
+    返回 (基础元数据, 分块结果, 错误信息)，日志统一由主进程输出。
+    """
+    # 提取基础元数据
+    base_metadata = _extract_metadata(doc)
+    try:
+        # create_documents 会为每个分块深拷贝一份元数据
+        chunks = _get_text_splitter().create_documents(
+            texts=[doc.page_content],
+            metadatas=[base_metadata]
+        )
+    except Exception as e:
+        return base_metadata, [], str(e)
+    return base_metadata, chunks, None
 
-        except Exception as e:
-            # 如果分块失败，打印错误和文件源，跳过该文档
-            tqdm.write(f"❌ 错误：文件 '{base_metadata.get('source', 'Unknown File')}' 分块失败，已跳过。错误: {e}")
-            continue
 
-        # 2. 进一步优化和添加元数据
-        for chunk in chunks:
-            # 确保元数据完整性
-            final_metadata = base_metadata.copy()
+def _assign_chunk_ids(doc: Document, chunks: List[Document]):
+    """
+    为文档的各知识块生成稳定的 chunk ID：由相对路径、块序号和内容共同哈希得到。
+    内容不变时 ID 不变，增量构建可据此跳过已入库的知识块。
+    """
+    relative_path = os.path.relpath(doc.metadata.get('source', ''), DOCS_PATH).replace(os.sep, '/')
+    for index, chunk in enumerate(chunks):
+        digest = hashlib.blake2b(
+            f"{relative_path}\0{index}\0{chunk.page_content}".encode('utf-8'), digest_size=8
+        ).hexdigest()
+        name = chunk.metadata.get('api_name') or chunk.metadata.get('source', 'chunk')
+        chunk.metadata['chunk_id'] = f"{name}_{digest}"
 
-            # 添加全局唯一的 chunk ID 或序号
-            final_metadata[
-                'chunk_id'] = f"{final_metadata.get('api_name', final_metadata.get('source', 'chunk'))}_{len(all_chunks)}"
 
-            chunk.metadata = final_metadata
-            all_chunks.append(chunk)
+def split_and_add_metadata(documents: List[Document]) -> Tuple[List[Document], List[str]]:
+    """
+    对文档进行结构化分块，并添加丰富的元数据。
+    未变化的文档直接复用分块缓存；其余文档的分块是纯 Python 的 CPU 密集操作，
+    使用进程池在多核上并行处理。
+    返回 (知识块列表, 分块失败的源文件路径列表)。
+    """
+    cache = ChunkCache()
+    source_paths = [doc.metadata.get('source', '') for doc in documents]
+
+    # 每个文档的分块结果，按文档顺序保存
+    chunks_by_doc: List[List[Document]] = [[] for _ in documents]
+    # 分块失败的文档没有知识块，调用方需据此避免把它们已入库的知识块当作失效数据删除
+    failed_sources: List[str] = []
+    pending = []
+    for i, source_path in enumerate(source_paths):
+        cached_chunks = cache.get(source_path)
+        if cached_chunks is None:
+            pending.append(i)
+        else:
+            chunks_by_doc[i] = cached_chunks
+
+    print(f"-> 分块缓存命中 {len(documents) - len(pending)} 个文档，需要重新分块 {len(pending)} 个文档。")
+
+    if pending:
+        print("-> 正在进行结构化分块和元数据提取...")
+
+        with ProcessPoolExecutor(max_workers=SPLIT_MAX_WORKERS) as executor:
+            # executor.map 按输入顺序返回结果；使用 tqdm 显示进度
+            results = executor.map(_split_one, [documents[i] for i in pending], chunksize=16)
+            for i, (base_metadata, chunks, error) in zip(pending, tqdm(results, total=len(pending), desc="分块处理进度")):
+                if error is not None:
+                    # 如果分块失败，打印错误和文件源，跳过该文档 (不写入缓存，下次重试)
+                    tqdm.write(f"❌ 错误：文件 '{base_metadata.get('source', 'Unknown File')}' 分块失败，已跳过。错误: {error}")
+                    failed_sources.append(source_paths[i])
+                    continue
+
+                # 检查分块结果是否有效
+                if not chunks:
+                    # 使用 tqdm.write 避免进度条被干扰
+                    tqdm.write(f"⚠️ 警告：文件 '{base_metadata.get('source', 'Unknown File')}' 分块后为空，已跳过。")
+
+                _assign_chunk_ids(documents[i], chunks)
+                cache.put(source_paths[i], chunks)
+                chunks_by_doc[i] = chunks
+
+    cache.prune(source_paths)
+    cache.save()
+
+    all_chunks = [chunk for chunks in chunks_by_doc for chunk in chunks]
 
     print(f"-> 分块完成，共生成 {len(all_chunks)} 个高质量知识块。")
-    return all_chunks
+    if failed_sources:
+        print(f"⚠️ 警告：{len(failed_sources)} 个文档分块失败，它们已入库的知识块将被保留。")
+    return all_chunks, failed_sources
 
 
 # --------------------
 # 3. 主流程
 # --------------------
 
-def get_processed_chunks() -> List[Document]:
+def get_processed_chunks() -> Tuple[List[Document], List[str]]:
     """
-    执行完整的文档加载和处理流程。
+    执行完整的文档加载和处理流程，返回 (知识块列表, 分块失败的源文件路径列表)。
     """
     try:
         documents = load_documents()
         if not documents:
-            return []
-        processed_chunks = split_and_add_metadata(documents)
-        return processed_chunks
+            return [], []
+        return split_and_add_metadata(documents)
     except Exception as e:
         print(f"处理文档时发生未知错误: {e}")
-        return []
\ No newline at end of file
+        return [], []
@@ -1,5 +1,6 @@
 import os
 import asyncio
+from typing import AsyncIterator
 from dotenv import load_dotenv
 # 修复导入：使用新的 ChatOllama 路径 (尽管它在新版本中也被弃用，但目前可用)
 from langchain_community.chat_models.ollama import ChatOllama
@@ -37,24 +38,25 @@ class RAGEngine:
         self.llm_model_name = None
         self.llm_base_url = None
         self.k_value = None
+        self.llm = None
+        # 提示词模板与 LLM 配置无关，只需解析一次
+        self.prompt = ChatPromptTemplate.from_template(self.RAG_PROMPT)
         self.chain: Runnable = None
 
-    def configure(self, llm_model_name: str, llm_base_url: str, k_value: int):
+    def configure_llm(self, llm_model_name: str, llm_base_url: str):
         """
-        根据设置页面动态配置 LLM 和检索 K 值。
+        根据设置页面动态配置 LLM。仅在模型名称或 Base URL 变化时重建 LLM 和 Chain。
         """
         # 优化：如果配置未变，无需重新初始化
         if (self.llm_model_name == llm_model_name and
                 self.llm_base_url == llm_base_url and
-                self.k_value == k_value and
                 self.chain is not None):
             return
 
         self.llm_model_name = llm_model_name
         self.llm_base_url = llm_base_url
-        self.k_value = k_value
 
-        # 2. 重新初始化 Ollama 客户端
+        # 重新初始化 Ollama 客户端
         try:
             # 使用 ChatOllama 客户端连接本地 LLM
             self.llm = ChatOllama(
@@ -62,29 +64,49 @@ class RAGEngine:
                 base_url=self.llm_base_url,
                 temperature=0.0
             )
-            self.prompt = ChatPromptTemplate.from_template(self.RAG_PROMPT)
             # 创建 Runnable Chain
             self.chain = self.prompt | self.llm
-            print(f"✅ RAGEngine: 配置更新成功。LLM: {self.llm_model_name}, K: {self.k_value}")
+            print(f"✅ RAGEngine: LLM 配置更新成功。LLM: {self.llm_model_name}")
         except Exception as e:
             print(f"❌ RAGEngine: Ollama LLM 配置或连接失败。错误: {e}")
             self.llm = None
             self.chain = None
             raise RuntimeError("LLM 配置失败，请检查 Ollama 服务。")
 
+    def configure_retrieval(self, k_value: int):
+        """
+        配置检索 K 值。K 只影响检索，与 LLM Chain 无关，修改时无需重建 Chain。
+        """
+        if self.k_value == k_value:
+            return
+        self.k_value = k_value
+        print(f"✅ RAGEngine: 检索配置更新成功。K: {self.k_value}")
+
+    # 上下文各文档块之间的分隔符
+    CONTEXT_SEPARATOR = "\n\n---\n\n"
+
     def _format_context(self, documents: list[Document]) -> str:
         """将检索到的文档格式化为 LLM 可用的字符串。"""
-        formatted_context = []
-        for doc in documents:
-            source = doc.metadata.get('source', '未知来源')
-            api_name = doc.metadata.get('api_name', '通用')
-
-            # 使用 Markdown 格式化，强调来源
-            formatted_context.append(
-                f"### 来源: {source} (API: {api_name})\n"
-                f"```text\n{doc.page_content}\n```"
-            )
-        return "\n\n---\n\n".join(formatted_context)
+        # 使用 Markdown 格式化，强调来源；生成器直接交给 join，单次遍历且不创建中间列表
+        return self.CONTEXT_SEPARATOR.join(
+            f"### 来源: {doc.metadata.get('source', '未知来源')} (API: {doc.metadata.get('api_name', '通用')})\n"
+            f"```text\n{doc.page_content}\n```"
+            for doc in documents
+        )
+
+    async def _build_inputs(self, query: str) -> dict:
+        """检索上下文并组装 Chain 的输入。"""
+        # 异步检索上下文 (查询向量化和向量检索都不阻塞事件循环)
+        retrieved_docs = await self.db_manager.aretrieve_documents(query, k=self.k_value)
+        context = self._format_context(retrieved_docs)
+
+        if not context:
+            context = "未找到任何相关的知识文档。"
+
+        return {
+            "context": context,
+            "question": query
+        }
 
     async def generate_answer(self, query: str) -> str:
         """
@@ -94,22 +116,35 @@ class RAGEngine:
             return "RAG 引擎未配置或 LLM 连接失败，请检查设置和 Ollama 服务状态。"
 
         try:
-            # 1. 同步检索上下文 (DBManager 内部没有异步 API)
-            retrieved_docs = self.db_manager.retrieve_documents(query, k=self.k_value)
-            context = self._format_context(retrieved_docs)
-
-            if not context:
-                context = "未找到任何相关的知识文档。"
+            # 1. 检索上下文
+            inputs = await self._build_inputs(query)
 
             # 2. 异步调用 LLM Chain
-            # 这里的 ainvoke 是关键，它允许在 QThreadPool 线程中运行 asyncio 循环等待
-            response = await self.chain.ainvoke({
-                "context": context,
-                "question": query
-            })
+            # 这里的 ainvoke 是关键，它在主应用的常驻事件循环中等待，不阻塞其他查询
+            response = await self.chain.ainvoke(inputs)
 
             return response.content
 
         except Exception as e:
             print(f"❌ 异步 LLM 调用失败。错误: {e}")
-            return f"❌ LLM 生成答案失败。请检查 Ollama 服务连接和模型状态。错误: {e}"
\ No newline at end of file
+            return f"❌ LLM 生成答案失败。请检查 Ollama 服务连接和模型状态。错误: {e}"
+
+    async def astream_answer(self, query: str) -> AsyncIterator[str]:
+        """
+        执行 RAG 流程，逐 Token 产出答案，UI 可在首个 Token 到达时立即开始显示。
+        出错时产出错误提示文本作为最后一段。
+        """
+        if not self.chain:
+            yield "RAG 引擎未配置或 LLM 连接失败，请检查设置和 Ollama 服务状态。"
+            return
+
+        try:
+            inputs = await self._build_inputs(query)
+
+            async for chunk in self.chain.astream(inputs):
+                if chunk.content:
+                    yield chunk.content
+
+        except Exception as e:
+            print(f"❌ 异步 LLM 调用失败。错误: {e}")
+            yield f"\n\n❌ LLM 生成答案失败。请检查 Ollama 服务连接和模型状态。错误: {e}"
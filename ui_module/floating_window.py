@@ -1,13 +1,86 @@
-import sys
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
-    QLineEdit, QTextEdit, QPushButton, QLabel,
-    QSizePolicy, QSizePolicy
+    QLineEdit, QTextEdit, QPushButton, QLabel, QSizePolicy
 )
-from PyQt6.QtCore import Qt, pyqtSignal, QSize, QSettings, QPoint, QRect
-from PyQt6.QtGui import QFont, QColor, QPalette
+from PyQt6.QtCore import Qt, pyqtSignal, QSize, QSettings, QPoint, QRect, QTimer
+from PyQt6.QtGui import QFont, QTextCursor, QTextBlockFormat, QTextCharFormat
 from rag_core.config import SETTINGS_FILE
+from ui_module.theme import apply_theme
 
+# 共享的字体实例：QFont 只是描述字体的值对象，可以在 QApplication 创建前构造，
+# 各控件复用同一份描述，减少字体匹配
+_TITLE_FONT = QFont("Inter", 16, QFont.Weight.Bold)
+_BODY_FONT = QFont("Inter", 10)
+
+
+class _IncrementalMarkdown:
+    """
+    流式答案的增量 Markdown 渲染器。
+    答案按代码块 (```) 之外的空行切分为段落，已完成的段落只渲染一次并保留在文档中，
+    每次刷新只删除并重新渲染末尾仍在生成的段落，渲染开销与尾部长度而非整篇答案成正比。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """开始新的答案；下一次 flush_to 会清空输出区域。"""
+        # 已完成但尚未写入文档的段落
+        self.completed_paragraphs = []
+        # 仍在生成中的末尾段落
+        self.tail = ""
+        # 已完成部分的末尾是否处于代码块内
+        self._in_fence = False
+        # 标记文档中末尾段落起点的游标；文档变化时 Qt 会自动调整其位置
+        self._tail_anchor = None
+
+    def _find_boundary(self):
+        """返回 tail 中最后一个代码块之外的空行之后的位置 (没有则为 0) 及该处的代码块状态。"""
+        in_fence = self._in_fence
+        boundary, fence_at_boundary = 0, in_fence
+        offset = 0
+        # 最后一行可能尚未结束，不参与判断
+        for line in self.tail.split("\n")[:-1]:
+            offset += len(line) + 1
+            if line.lstrip().startswith("```"):
+                in_fence = not in_fence
+            elif not in_fence and not line.strip():
+                boundary, fence_at_boundary = offset, in_fence
+        return boundary, fence_at_boundary
+
+    def append(self, chunk: str):
+        """追加新的文本，并把已经结束的段落从 tail 中移出。"""
+        self.tail += chunk
+        boundary, self._in_fence = self._find_boundary()
+        if boundary:
+            done, self.tail = self.tail[:boundary], self.tail[boundary:]
+            if done.strip():
+                self.completed_paragraphs.append(done)
+
+    def flush_to(self, text_edit: QTextEdit):
+        """在一个编辑块内写入新完成的段落，并替换文档末尾的进行中段落。"""
+        cursor = QTextCursor(text_edit.document())
+        cursor.beginEditBlock()
+        if self._tail_anchor is None:
+            # 新答案：清空 "正在思考..." 等旧内容
+            cursor.select(QTextCursor.SelectionType.Document)
+            self._tail_anchor = QTextCursor(text_edit.document())
+            # 在锚点处插入文本时锚点保持不动，始终指向末尾段落的起点
+            self._tail_anchor.setKeepPositionOnInsert(True)
+        else:
+            cursor.setPosition(self._tail_anchor.position())
+            cursor.movePosition(QTextCursor.MoveOperation.End, QTextCursor.MoveMode.KeepAnchor)
+        cursor.removeSelectedText()
+
+        for paragraph in self.completed_paragraphs:
+            cursor.insertMarkdown(paragraph)
+            # 以默认格式另起一块，避免末尾段落继承标题、列表或代码块的格式
+            cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        self.completed_paragraphs = []
+        self._tail_anchor.setPosition(cursor.position())
+
+        cursor.insertMarkdown(self.tail)
+        cursor.endEditBlock()
 
 class FloatingWindow(QWidget):
     """
@@ -20,14 +93,40 @@ class FloatingWindow(QWidget):
     # 窗口默认大小和持久化设置
     DEFAULT_WIDTH = 550
     DEFAULT_HEIGHT = 450
+    # 流式输出时合并刷新的间隔 (毫秒)，期间到达的 Token 只触发一次 Markdown 渲染
+    RENDER_INTERVAL_MS = 50
+    # 输出区域文档保留的最大文本块数
+    MAX_OUTPUT_BLOCKS = 2000
+    # 保存窗口位置的防抖间隔 (毫秒)，连续呼出/隐藏只写入一次
+    SAVE_POSITION_DELAY_MS = 500
 
     def __init__(self, rag_engine):
         super().__init__()
         self.rag_engine = rag_engine
         self.is_visible = False
         self.current_theme = "Light"
+        # 当前流式答案的增量渲染器；由节流定时器统一刷新到输出区域
+        self._markdown = _IncrementalMarkdown()
+        self._throttle_timer = QTimer(self)
+        self._throttle_timer.setSingleShot(True)
+        self._throttle_timer.setInterval(self.RENDER_INTERVAL_MS)
+        self._throttle_timer.timeout.connect(self._flush_markdown)
+        self._save_timer = QTimer(self)
+        self._save_timer.setSingleShot(True)
+        self._save_timer.setInterval(self.SAVE_POSITION_DELAY_MS)
+        self._save_timer.timeout.connect(self._do_save_position)
+        # 退出应用时定时器可能尚未触发，立即保存一次
+        QApplication.instance().aboutToQuit.connect(self._do_save_position)
         # 初始化 QSettings
         self.settings = QSettings(SETTINGS_FILE, QSettings.Format.IniFormat)
+        # 缓存剪贴板文本：仅在剪贴板变化时读取，呼出窗口时不再同步查询系统剪贴板。
+        # 只有 Windows 和 X11 会在后台及时发出 dataChanged；macOS 仅在应用激活时发出，
+        # Wayland 下后台客户端收不到剪贴板事件，这些平台呼出窗口时仍直接读取剪贴板
+        self._cached_clip = None
+        if QApplication.platformName() in ("windows", "xcb"):
+            clipboard = QApplication.clipboard()
+            clipboard.dataChanged.connect(self._on_clipboard_changed)
+            self._cached_clip = clipboard.text().strip()
 
         self._setup_ui()
         self._load_position()  # 加载上次保存的位置
@@ -44,7 +143,7 @@ class FloatingWindow(QWidget):
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
         self.setMinimumSize(QSize(self.DEFAULT_WIDTH, self.DEFAULT_HEIGHT))
 
-        # 允许窗口使用鼠标拖动
+        # 平台不支持系统拖动时，回退到手动拖动所记录的按下位置
         self.oldPos = None
 
         # 2. 主布局
@@ -62,7 +161,7 @@ class FloatingWindow(QWidget):
         # 移除熊猫图标
         self.title_label = QLabel("RAG 编程助手")
         self.title_label.setObjectName("TitleLabel")
-        self.title_label.setFont(QFont("Inter", 16, QFont.Weight.Bold))
+        self.title_label.setFont(_TITLE_FONT)
         header_layout.addWidget(self.title_label)
 
         header_layout.addStretch(1)
@@ -80,10 +179,10 @@ class FloatingWindow(QWidget):
         self.output_area = QTextEdit()
         self.output_area.setObjectName("OutputArea")
         self.output_area.setReadOnly(True)
+        # 限制文档的最大块数，超出时从开头丢弃旧块，避免长答案使文档和布局开销无限增长
+        self.output_area.document().setMaximumBlockCount(self.MAX_OUTPUT_BLOCKS)
         self.output_area.setPlaceholderText("💡 按 Ctrl+Space 呼出，在这里输入您的问题...")
-        # 启用 Markdown 渲染
-        self.output_area.setMarkdown(self.output_area.placeholderText())
-        self.output_area.setFont(QFont("Inter", 10))
+        self.output_area.setFont(_BODY_FONT)
         self.output_area.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
         container_layout.addWidget(self.output_area)
 
@@ -92,15 +191,15 @@ class FloatingWindow(QWidget):
         self.input_field = QLineEdit()
         self.input_field.setObjectName("InputField")
         self.input_field.setPlaceholderText("输入查询...")
-        self.input_field.setFont(QFont("Inter", 10))
+        self.input_field.setFont(_BODY_FONT)
         self.input_field.returnPressed.connect(self._handle_submit)  # 绑定回车键
         input_layout.addWidget(self.input_field)
 
-        submit_button = QPushButton("提问")
-        submit_button.setObjectName("SubmitButton")
-        submit_button.setCursor(Qt.CursorShape.PointingHandCursor)
-        submit_button.clicked.connect(self._handle_submit)
-        input_layout.addWidget(submit_button)
+        self.submit_button = QPushButton("提问")
+        self.submit_button.setObjectName("SubmitButton")
+        self.submit_button.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.submit_button.clicked.connect(self._handle_submit)
+        input_layout.addWidget(self.submit_button)
 
         container_layout.addLayout(input_layout)
 
@@ -108,96 +207,27 @@ class FloatingWindow(QWidget):
         main_layout.addWidget(self.container)
 
     # --- 样式管理 ---
-    def _get_light_style(self):
-        """浅色模式 CSS."""
-        return """
-            #ContainerWidget {
-                background-color: white;
-                border-radius: 12px;
-                box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.1), 0 4px 6px -2px rgba(0, 0, 0, 0.05);
-            }
-            #TitleLabel { color: #4A5568; }
-            #SettingsButton { border: none; font-size: 18px; color: #4A5568;}
-            #SettingsButton:hover { background-color: rgba(0,0,0,0.1); border-radius: 5px; }
-            #OutputArea { 
-                background-color: #F7FAFC; 
-                border: 1px solid #E2E8F0; 
-                border-radius: 8px; 
-                padding: 10px;
-                color: #2D3748;
-            }
-            #InputField { 
-                padding: 10px; 
-                border: 1px solid #CBD5E0; 
-                border-radius: 8px;
-                color: #2D3748;
-            }
-            #SubmitButton {
-                background-color: #4299E1;
-                color: white;
-                border-radius: 8px;
-                padding: 10px 15px;
-                font-weight: bold;
-            }
-            #SubmitButton:hover { background-color: #3182CE; }
-        """
-
-    def _get_dark_style(self):
-        """深色模式 CSS."""
-        return """
-            #ContainerWidget {
-                background-color: #2D3748;
-                border-radius: 12px;
-                box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.3), 0 4px 6px -2px rgba(0, 0, 0, 0.1);
-            }
-            #TitleLabel { color: #E2E8F0; }
-            #SettingsButton { border: none; font-size: 18px; color: #E2E8F0;}
-            #SettingsButton:hover { background-color: rgba(255,255,255,0.1); border-radius: 5px; }
-            #OutputArea { 
-                background-color: #1A202C; 
-                border: 1px solid #4A5568; 
-                border-radius: 8px; 
-                padding: 10px;
-                color: #E2E8F0; 
-            }
-            #InputField { 
-                padding: 10px; 
-                border: 1px solid #4A5568; 
-                border-radius: 8px;
-                background-color: #1A202C;
-                color: #E2E8F0;
-            }
-            #SubmitButton {
-                background-color: #63B3ED;
-                color: #1A202C;
-                border-radius: 8px;
-                padding: 10px 15px;
-                font-weight: bold;
-            }
-            #SubmitButton:hover { background-color: #4299E1; }
-        """
-
     def update_theme(self, theme: str):
-        """根据设置应用主题."""
+        """根据设置应用主题 (样式表统一挂在 QApplication 上，见 ui_module.theme)."""
         self.current_theme = theme
-        if theme == "Dark":
-            self.container.setStyleSheet(self._get_dark_style())
-        else:
-            self.container.setStyleSheet(self._get_light_style())
+        apply_theme(theme)
 
     # --- 窗口位置管理 ---
     def _load_position(self):
         """加载上次保存的窗口位置，如果不存在则居中."""
-        # 尝试加载 QPoint 类型
-        pos = self.settings.value("WindowPosition", QPoint())
-        size = self.settings.value("WindowSize", QSize(self.DEFAULT_WIDTH, self.DEFAULT_HEIGHT))
-
-        # 校验位置和尺寸是否有效
-        if pos.isNull() or not QApplication.primaryScreen().geometry().contains(QRect(pos, size)):
-            # 居中逻辑
-            screen = QApplication.primaryScreen().geometry()
-            x = (screen.width() - self.DEFAULT_WIDTH) // 2
-            y = (screen.height() - self.DEFAULT_HEIGHT) // 2
+        # 由 QSettings 直接转换为 QPoint/QSize 类型
+        pos = self.settings.value("WindowPosition", QPoint(), type=QPoint)
+        size = self.settings.value("WindowSize", QSize(self.DEFAULT_WIDTH, self.DEFAULT_HEIGHT), type=QSize)
+
+        # 校验位置和尺寸是否有效；未保存过位置时返回的默认值 QPoint() 为 (0, 0)，
+        # 必须保留 isNull 判断，否则首次启动窗口会出现在屏幕左上角而不是居中
+        # 多显示器下按保存位置所在的屏幕校验，而不是总是与主屏幕比较
+        screen = None if pos.isNull() else QApplication.screenAt(pos)
+        if screen is None or not screen.geometry().contains(QRect(pos, size)):
+            # 居中逻辑：只查询一次主屏幕几何信息
+            screen_geo = QApplication.primaryScreen().geometry()
+            x = screen_geo.x() + (screen_geo.width() - self.DEFAULT_WIDTH) // 2
+            y = screen_geo.y() + (screen_geo.height() - self.DEFAULT_HEIGHT) // 2
             self.move(x, y)
             self.resize(self.DEFAULT_WIDTH, self.DEFAULT_HEIGHT)
         else:
@@ -205,7 +235,12 @@ class FloatingWindow(QWidget):
             self.resize(size)
 
     def _save_position(self):
+        """延迟保存窗口位置，SAVE_POSITION_DELAY_MS 内的多次调用合并为一次写入."""
+        self._save_timer.start()
+
+    def _do_save_position(self):
         """保存当前窗口位置和大小."""
+        self._save_timer.stop()
         self.settings.setValue("WindowPosition", self.pos())
         self.settings.setValue("WindowSize", self.size())
 
@@ -218,22 +253,53 @@ class FloatingWindow(QWidget):
             self.output_area.setPlaceholderText("正在思考...")
             # 将提示设置为纯文本，否则 setMarkdown("") 会显示 placeholder
             self.output_area.setText("正在思考...")
+            # 回答结束前禁止再次提问：多个流式回答会共用同一个输出区域，Token 会相互交错
             self.input_field.setEnabled(False)
+            self.submit_button.setEnabled(False)
+            self._markdown.reset()
             self.query_submitted.emit(query)
 
+    def append_token(self, token: str):
+        """
+        追加流式生成的 Token。不逐个 Token 渲染，而是最多每 RENDER_INTERVAL_MS 刷新一次，
+        且每次只重新渲染末尾仍在生成的段落。
+        """
+        self._markdown.append(token)
+        if not self._throttle_timer.isActive():
+            self._throttle_timer.start()
+
+    def _flush_markdown(self):
+        """将最新的流式文本渲染到输出区域。"""
+        self._markdown.flush_to(self.output_area)
+
     def update_result(self, result: str):
         """在输出区域显示 RAG 引擎的返回结果，支持 Markdown。"""
-        # 使用 setMarkdown 渲染 LLM 返回的 Markdown 文本
-        self.output_area.setMarkdown(result)
+        # 最终结果直接渲染，丢弃尚未刷新的流式文本，避免定时器随后用旧内容覆盖
+        self._throttle_timer.stop()
+        self._markdown.reset()
+        # 按段落增量渲染时跨段落的结构 (如有序列表编号) 可能略有偏差，最终结果整体渲染一次
+        # 在一个编辑块内替换文档内容，结束时只做一次布局
+        cursor = QTextCursor(self.output_area.document())
+        cursor.beginEditBlock()
+        cursor.select(QTextCursor.SelectionType.Document)
+        cursor.removeSelectedText()
+        cursor.insertMarkdown(result)
+        cursor.endEditBlock()
         self.output_area.setPlaceholderText("在这里输入您的问题...")
         self.input_field.setEnabled(True)
+        self.submit_button.setEnabled(True)
         self.input_field.clear()
 
     # --- 剪贴板集成和显示 ---
+    def _on_clipboard_changed(self):
+        """剪贴板内容变化时更新缓存的文本。"""
+        self._cached_clip = QApplication.clipboard().text().strip()
+
     def _populate_input_with_clipboard(self):
-        """读取剪贴板内容并填充到输入框。"""
-        clipboard = QApplication.clipboard()
-        text = clipboard.text().strip()
+        """将剪贴板内容 (有缓存时使用缓存) 填充到输入框。"""
+        text = self._cached_clip
+        if text is None:
+            text = QApplication.clipboard().text().strip()
 
         # 仅在文本非空时填充，否则保持清空
         self.input_field.setText(text)
@@ -266,9 +332,12 @@ class FloatingWindow(QWidget):
 
     # --- 鼠标拖动实现无边框窗口移动 ---
     def mousePressEvent(self, event):
-        # 仅允许在标题栏区域拖动
+        # 仅允许在标题栏区域拖动；优先交给窗口管理器处理，移动鼠标时无需逐事件计算位置
         if event.button() == Qt.MouseButton.LeftButton and self.title_label.geometry().contains(event.pos()):
-            self.oldPos = event.pos()
+            window_handle = self.windowHandle()
+            # 平台或窗口管理器不支持系统拖动时 startSystemMove 返回 False，改为手动计算位移
+            if window_handle is None or not window_handle.startSystemMove():
+                self.oldPos = event.pos()
             event.accept()
 
     def mouseMoveEvent(self, event):
@@ -283,5 +352,6 @@ class FloatingWindow(QWidget):
 
     # 确保退出时保存位置
     def closeEvent(self, event):
-        self._save_position()
+        # 关闭时必须同步保存，不经过防抖定时器
+        self._do_save_position()
         super().closeEvent(event)
\ No newline at end of file
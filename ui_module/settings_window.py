@@ -3,8 +3,10 @@ from PyQt6.QtWidgets import (
     QLineEdit, QSpinBox, QComboBox, QPushButton,
     QGridLayout, QGroupBox, QMessageBox, QApplication
 )
-from PyQt6.QtCore import Qt, QSettings, pyqtSignal
-from rag_core.config import SETTINGS_FILE, DEFAULT_THEME
+from PyQt6.QtCore import QSettings, pyqtSignal
+from rag_core.config import (
+    SETTINGS_FILE, DEFAULT_THEME, DEFAULT_LLM_MODEL_NAME, DEFAULT_LLM_BASE_URL, DEFAULT_RETRIEVAL_K
+)
 
 
 class SettingsWindow(QWidget):
@@ -72,15 +74,14 @@ class SettingsWindow(QWidget):
         button_layout = QHBoxLayout()
 
         # 新增退出按钮 (连接到 QApplication.instance().quit)
+        # 按钮样式由 ui_module.theme 中的全局样式表通过 objectName 匹配
         exit_button = QPushButton("🔴 退出应用")
+        exit_button.setObjectName("ExitButton")
         exit_button.clicked.connect(QApplication.instance().quit)
-        exit_button.setStyleSheet(
-            "background-color: #E53E3E; color: white; border-radius: 8px; padding: 10px 15px; font-weight: bold;")
 
         save_button = QPushButton("💾 保存设置")
+        save_button.setObjectName("SaveButton")
         save_button.clicked.connect(self._save_settings)
-        save_button.setStyleSheet(
-            "background-color: #4299E1; color: white; border-radius: 8px; padding: 10px 15px; font-weight: bold;")
 
         button_layout.addWidget(exit_button)  # 将退出按钮放在左侧
         button_layout.addStretch(1)
@@ -88,21 +89,25 @@ class SettingsWindow(QWidget):
 
         main_layout.addLayout(button_layout)
 
+    def _read_settings(self):
+        """从 QSettings 的内存缓存中读取配置，如果不存在则使用 config.py 中的默认值。"""
+        return {
+            "model": self.settings.value("LLM_MODEL_NAME", DEFAULT_LLM_MODEL_NAME),
+            "url": self.settings.value("LLM_BASE_URL", DEFAULT_LLM_BASE_URL),
+            # INI 文件中的数字以字符串保存，由 QSettings 转换为整数
+            "k": self.settings.value("RETRIEVAL_K", DEFAULT_RETRIEVAL_K, type=int),
+            "theme": self.settings.value("THEME", DEFAULT_THEME)
+        }
+
     def _load_settings(self):
         """从 QSettings 加载配置并更新 UI 控件。"""
-        from rag_core.config import DEFAULT_LLM_MODEL_NAME, DEFAULT_LLM_BASE_URL, DEFAULT_RETRIEVAL_K
+        # 结果缓存起来，get_current_settings 直接返回，保存设置后才失效
+        self._cached = self._read_settings()
 
-        # 读取配置，如果不存在则使用 config.py 中的默认值
-        model_name = self.settings.value("LLM_MODEL_NAME", DEFAULT_LLM_MODEL_NAME)
-        base_url = self.settings.value("LLM_BASE_URL", DEFAULT_LLM_BASE_URL)
-        # QSettings 读取数字时可能是字符串，需要转换
-        k_value = int(self.settings.value("RETRIEVAL_K", DEFAULT_RETRIEVAL_K))
-        theme = self.settings.value("THEME", DEFAULT_THEME)
-
-        self.model_input.setText(model_name)
-        self.url_input.setText(base_url)
-        self.k_spinbox.setValue(k_value)
-        self.theme_combo.setCurrentText(theme)
+        self.model_input.setText(self._cached["model"])
+        self.url_input.setText(self._cached["url"])
+        self.k_spinbox.setValue(self._cached["k"])
+        self.theme_combo.setCurrentText(self._cached["theme"])
 
     def _save_settings(self):
         """将 UI 控件中的值保存到 QSettings。"""
@@ -120,19 +125,21 @@ class SettingsWindow(QWidget):
         self.settings.setValue("RETRIEVAL_K", k_value)
         self.settings.setValue("THEME", theme)
         self.settings.sync()  # 确保写入磁盘
+        self._cached = None  # 设置已变化，下次读取时重新生成
 
         print("✅ 设置已保存，正在通知主应用更新配置...")
         self.settings_updated.emit()
         self.close()
 
-    def get_current_settings(self):
-        """提供一个接口让 main_app 获取最新的持久化设置。"""
-        # 确保读取最新的值
-        self.settings.sync()
-        return {
-            "model": self.settings.value("LLM_MODEL_NAME"),
-            "url": self.settings.value("LLM_BASE_URL"),
-            # 确保 K 值返回整数
-            "k": int(self.settings.value("RETRIEVAL_K")),
-            "theme": self.settings.value("THEME")
-        }
\ No newline at end of file
+    def get_current_settings(self, refresh=False):
+        """
+        提供一个接口让 main_app 获取最新的持久化设置。
+        应用是单进程的，设置文件只有 _save_settings 会写入，因此默认直接返回缓存，
+        仅在 refresh=True 时从磁盘重新加载 (例如设置文件被外部修改)。
+        """
+        if refresh:
+            self.settings.sync()
+            self._cached = None
+        if self._cached is None:
+            self._cached = self._read_settings()
+        return self._cached
\ No newline at end of file
@@ -1,69 +1,109 @@
+import sys
 import threading
 from pynput import keyboard
-from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtCore import QObject, QAbstractEventDispatcher, QAbstractNativeEventFilter, pyqtSignal
+
+# pyqtkeybind 为可选依赖 (pip install pyqtkeybind)：它向操作系统注册热键，只有组合键触发时进程才被唤醒。
+# 其 X11 后端依赖 PyQt5，在 PyQt6 下导入会失败，此时回退到 pynput 监听
+try:
+    from pyqtkeybind import keybinder
+except Exception:
+    keybinder = None
+
+HOTKEY = "Ctrl+Space"
+
+
+class _NativeHotkeyFilter(QAbstractNativeEventFilter):
+    """把 Qt 收到的原生事件交给 pyqtkeybind，识别出已注册的热键消息并触发回调。"""
+
+    def __init__(self, binder):
+        super().__init__()
+        self.binder = binder
+
+    def nativeEventFilter(self, eventType, message):
+        # PyQt6 传入的 eventType 是 QByteArray，pyqtkeybind 按字符串比较
+        handled = self.binder.handler(bytes(eventType).decode(), message)
+        return bool(handled), 0
 
 
 class ShortcutListener(QObject):
     """
-    使用 pynput 在后台监听全局快捷键 (Ctrl+Space)。
+    监听全局快捷键 (Ctrl+Space)。
+    优先通过 pyqtkeybind 向操作系统注册热键 (Windows 的 RegisterHotKey)，无需后台线程逐键处理；
+    不支持的平台 (macOS、Wayland、PyQt6 下的 X11) 回退到 pynput 在后台线程中监听。
     """
     # 定义信号，用于通知主线程切换窗口可见性
     shortcut_pressed = pyqtSignal()
 
-    def __init__(self, parent=None):
+    def __init__(self, window_id=None, parent=None):
         super().__init__(parent)
+        # 接收 WM_HOTKEY 的窗口句柄。热键必须注册到真实窗口：Qt 只以 windows_generic_MSG
+        # 上报发给窗口的消息，pyqtkeybind 也只处理这一类；注册到句柄 0 的热键会作为线程消息投递而无法触发
+        self.window_id = window_id
         self.listener_thread = None
         self.hotkey = keyboard.Key.space
         self.modifier = keyboard.Key.ctrl_l  # 左侧 Ctrl 键
+        # Ctrl 是否处于按下状态；只在 Ctrl 按下/释放时更新
+        self._modifier_down = False
+        # 原生热键注册成功后保存事件过滤器，stop() 时据此注销
+        self._native_filter = None
 
-    def _on_press(self, key):
-        """按键按下时的回调函数。"""
+    def _register_native_hotkey(self) -> bool:
+        """尝试向操作系统注册热键，成功返回 True。"""
+        if keybinder is None or self.window_id is None or not sys.platform.startswith("win"):
+            return False
         try:
-            # 检查是否同时按下了 Ctrl 和 Space
-            if key == self.hotkey and self.modifier in self.current_keys:
-                # 在按 Space 时触发信号
-                # 必须使用 emit 才能安全地与 PyQt 主线程交互
-                self.shortcut_pressed.emit()
+            keybinder.init()
+            if not keybinder.register_hotkey(self.window_id, HOTKEY, self.shortcut_pressed.emit):
+                return False
+        except Exception as e:
+            print(f"⚠️ 原生快捷键注册失败，改用 pynput 监听。错误信息: {e}")
+            return False
+
+        self._native_filter = _NativeHotkeyFilter(keybinder)
+        QAbstractEventDispatcher.instance().installNativeEventFilter(self._native_filter)
+        print(f"⌨️ 已向系统注册全局快捷键: {HOTKEY}")
+        return True
 
-        except AttributeError:
-            pass  # 忽略非字符键
+    def _on_press(self, key):
+        """按键按下时的回调函数 (每次全局按键都会调用，保持尽量轻量)。"""
+        # Key 枚举成员是单例，用 is 比较即可，无需调用 __eq__
+        if key is self.modifier:
+            self._modifier_down = True
+        elif key is self.hotkey and self._modifier_down:
+            # 在按 Space 时触发信号
+            # 必须使用 emit 才能安全地与 PyQt 主线程交互
+            self.shortcut_pressed.emit()
 
     def _on_release(self, key):
         """按键释放时的回调函数。"""
-        try:
-            if key in self.current_keys:
-                self.current_keys.remove(key)
-        except KeyError:
-            pass
-        except Exception as e:
-            print(f"快捷键监听释放错误: {e}")
+        if key is self.modifier:
+            self._modifier_down = False
 
     def _start_listening(self):
         """在新的线程中启动 pynput 监听器。"""
         print("⌨️ 快捷键监听器启动: Ctrl + Space...")
-        # 当前按下的键集合
-        self.current_keys = set()
-
-        # pynput 的 KeyCode 无法直接与 Key 进行集合操作，需要特殊处理
-        def on_press_wrapper(key):
-            if key not in self.current_keys:
-                self.current_keys.add(key)
-            self._on_press(key)
-
-        with keyboard.Listener(on_press=on_press_wrapper, on_release=self._on_release) as listener:
+        with keyboard.Listener(on_press=self._on_press, on_release=self._on_release) as listener:
             try:
                 listener.join()
             except Exception as e:
                 print(f"❌ 快捷键监听器线程异常终止: {e}")
 
     def start(self):
-        """启动监听器线程。"""
-        if self.listener_thread is None:
-            self.listener_thread = threading.Thread(target=self._start_listening, daemon=True)
-            self.listener_thread.start()
+        """注册原生热键；不可用时启动 pynput 监听器线程。"""
+        if self._native_filter is not None or self.listener_thread is not None:
+            return
+        if self._register_native_hotkey():
+            return
+        self.listener_thread = threading.Thread(target=self._start_listening, daemon=True)
+        self.listener_thread.start()
 
     def stop(self):
         """停止监听器 (通常在应用关闭时调用)。"""
+        if self._native_filter is not None:
+            keybinder.unregister_hotkey(self.window_id, HOTKEY)
+            QAbstractEventDispatcher.instance().removeNativeEventFilter(self._native_filter)
+            self._native_filter = None
         # pynput 的 listener.stop() 需要在 listener 内部调用
-        # 这里只是提供一个停止的接口，实际应用中依赖 daemon 线程在主程序退出时自动关闭
-        print("快捷键监听器停止。")
\ No newline at end of file
+        # 回退路径依赖 daemon 线程在主程序退出时自动关闭
+        print("快捷键监听器停止。")
@@ -0,0 +1,93 @@
+from PyQt6.QtWidgets import QApplication
+
+# 浅色/深色模式只有颜色不同，共用同一个 QSS 模板，按调色板在导入时各生成一次。
+# 所有选择器都基于 objectName，因此样式表可以统一挂在 QApplication 上，
+# 悬浮窗和设置窗口共用一次样式解析，而不是逐个控件调用 setStyleSheet。
+_PALETTE = {
+    "Light": {
+        "container_bg": "white",
+        "shadow_strong": "0.1",
+        "shadow_weak": "0.05",
+        "title_fg": "#4A5568",
+        "hover_bg": "rgba(0,0,0,0.1)",
+        "output_bg": "#F7FAFC",
+        "output_border": "#E2E8F0",
+        "text_fg": "#2D3748",
+        "input_bg": "white",
+        "input_border": "#CBD5E0",
+        "button_bg": "#4299E1",
+        "button_fg": "white",
+        "button_hover_bg": "#3182CE",
+        "danger_bg": "#E53E3E",
+        "danger_fg": "white",
+    },
+    "Dark": {
+        "container_bg": "#2D3748",
+        "shadow_strong": "0.3",
+        "shadow_weak": "0.1",
+        "title_fg": "#E2E8F0",
+        "hover_bg": "rgba(255,255,255,0.1)",
+        "output_bg": "#1A202C",
+        "output_border": "#4A5568",
+        "text_fg": "#E2E8F0",
+        "input_bg": "#1A202C",
+        "input_border": "#4A5568",
+        "button_bg": "#63B3ED",
+        "button_fg": "#1A202C",
+        "button_hover_bg": "#4299E1",
+        "danger_bg": "#E53E3E",
+        "danger_fg": "white",
+    },
+}
+
+_QSS_TEMPLATE = """
+    #ContainerWidget {{
+        background-color: {container_bg};
+        border-radius: 12px;
+        box-shadow: 0 10px 15px -3px rgba(0, 0, 0, {shadow_strong}), 0 4px 6px -2px rgba(0, 0, 0, {shadow_weak});
+    }}
+    #TitleLabel {{ color: {title_fg}; }}
+    #SettingsButton {{ border: none; font-size: 18px; color: {title_fg};}}
+    #SettingsButton:hover {{ background-color: {hover_bg}; border-radius: 5px; }}
+    #OutputArea {{
+        background-color: {output_bg};
+        border: 1px solid {output_border};
+        border-radius: 8px;
+        padding: 10px;
+        color: {text_fg};
+    }}
+    #InputField {{
+        padding: 10px;
+        border: 1px solid {input_border};
+        border-radius: 8px;
+        background-color: {input_bg};
+        color: {text_fg};
+    }}
+    #SubmitButton, #SaveButton, #ExitButton {{
+        background-color: {button_bg};
+        color: {button_fg};
+        border-radius: 8px;
+        padding: 10px 15px;
+        font-weight: bold;
+    }}
+    #SubmitButton:hover, #SaveButton:hover {{ background-color: {button_hover_bg}; }}
+    #ExitButton {{ background-color: {danger_bg}; color: {danger_fg}; }}
+"""
+
+_QSS = {name: _QSS_TEMPLATE.format(**palette) for name, palette in _PALETTE.items()}
+
+# 最近一次应用到 QApplication 的样式表
+_last_qss = None
+
+
+def apply_theme(theme: str):
+    """
+    将主题样式表应用到整个 QApplication。与上次应用的样式表相同时直接返回，
+    避免 Qt 重新解析样式表并重新 polish 整个控件树。
+    """
+    global _last_qss
+    qss = _QSS.get(theme, _QSS["Light"])
+    if qss is _last_qss:
+        return
+    QApplication.instance().setStyleSheet(qss)
+    _last_qss = qss